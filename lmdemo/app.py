@@ -1,13 +1,55 @@
-from fastapi import FastAPI
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from time import monotonic
+
+from fastapi import FastAPI, Request
 from starlette.middleware.cors import CORSMiddleware
 
+from . import pool
 from .routers import chat, qa
 from .settings import settings
+from .utils import timing
+
+
+async def shutdown():
+    """不再接受新的会话与交互，等待进行中的交互完成（最多 ``drain_timeout`` 秒），然后并行地结束所有后端并等待它们退出
+    """
+    logger = logging.getLogger(__name__)
+    pool.drain()
+    chat.admission.close()
+    qa.admission.close()
+    ts = monotonic()
+    while chat.admission.pending + qa.admission.pending and monotonic() - ts < settings.drain_timeout:
+        await asyncio.sleep(0.1)
+    pending = chat.admission.pending + qa.admission.pending
+    if pending:
+        logger.warning('shutdown: %d requests still in flight after %ss', pending, settings.drain_timeout)
+    interactors = [bo.interactor for bo in chat.backends.values()] + [v[1] for v in qa.backends.values()]
+    logger.info('shutdown: terminating %d backends', len(interactors))
+    await asyncio.gather(
+        *(interactor.shutdown(settings.shutdown_grace) for interactor in interactors),
+        return_exceptions=True
+    )
+    logger.info('shutdown: done in %.1fs', monotonic() - ts)
+
+
+@asynccontextmanager
+async def lifespan(_):
+    sampler = asyncio.ensure_future(pool.memory.run(settings.memory_sample_interval))
+    try:
+        yield
+    finally:
+        sampler.cancel()
+        await shutdown()
+
 
 # pylint:disable=invalid-name
 app = FastAPI(
     title="LM Demo",
     description="Language Model Demo WebService",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -19,6 +61,44 @@ app.add_middleware(
 app.include_router(chat.router, prefix='/chat', tags=['chat'])
 app.include_router(qa.router, prefix='/qa', tags=['qa'])
 
+
+@app.middleware('http')
+async def server_timing(request: Request, call_next):
+    """在 ``Server-Timing`` 响应头中返回各阶段的耗时，并把慢请求写入 ``lmdemo.slow`` 日志
+    """
+    timings = timing.start()
+    response = await call_next(request)
+    timings.finish()
+    response.headers['Server-Timing'] = timings.header()
+    if timings.total > settings.slow_request_threshold:
+        logging.getLogger('lmdemo.slow').warning(json.dumps({
+            'method': request.method,
+            'path': request.url.path,
+            'status': response.status_code,
+            'phases': {k: round(v * 1000, 1) for k, v in timings.phases.items()},
+        }, ensure_ascii=False))
+    return response
+
+
 @app.get("/")
 def root():
     return {"message": "Hello World"}
+
+
+@app.get('/stats')
+def stats():
+    """准入控制、限流、调度、缓存、内存与进程加载的计数器
+    """
+    return {
+        'admission': [chat.admission.stats(), qa.admission.stats()],
+        'rate_limit': [chat.rate_limiter.stats(), qa.rate_limiter.stats()],
+        'scheduler': pool.scheduler.stats(),
+        'models': {name: scheduler.stats() for name, scheduler in pool.model_schedulers.items()},
+        'qa_cache': {name: cache.stats() for name, cache in qa.answer_caches.items()},
+        'memory': pool.memory.stats(),
+        'spawner': pool.spawner.stats(),
+        'latency': {
+            'chat': {str(uid): bo.interactor.latency_stats() for uid, bo in chat.backends.items()},
+            'qa': {str(uid): interactor.latency_stats() for uid, (_, interactor, *_) in qa.backends.items()},
+        },
+    }
@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import List
 from uuid import UUID
 
 from pydantic import BaseModel, Field
@@ -10,10 +11,22 @@ class BackendState(str, Enum):
     terminated = 'terminated'
 
 
+class Priority(str, Enum):
+    interactive = 'interactive'
+    batch = 'batch'
+
+
 class Backend(BaseModel):
     uid: UUID
+    model: str = 'default'
     state: BackendState = BackendState.pending
     pid: int = 0
     program: str = ''
     args: str = ''
     cwd: str = ''
+    socket: str = ''
+    cpus: List[int] = []
+    rss: int = 0  # 最近一次采样的常驻内存（字节）
+    memory_limit: int = 0  # 地址空间的上限（字节），0 表示不限制
+    queued: bool = False  # 正在排队等待加载
+    progress: float = 0.  # 加载进度 (0~1)，按同一程序上次启动时的输出行数估算
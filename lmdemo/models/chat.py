@@ -100,6 +100,14 @@ class PromptResultMessage(BaseResultMessage):
     message: PromptResultBody = Field(...)
 
 
+class SessionSnapshot(BaseModel):
+    state: str = Field(...)
+    dialog_count: int = 0
+    history: List['AllMessages'] = []
+
+
 IncomingMessages = Union[TextMessage, SuggestResultMessage, PromptResultMessage]
 OutgoingMessages = Union[TextMessage, SuggestMessage, PromptMessage]
 AllMessages = Union[TextMessage, SuggestMessage, SuggestResultMessage, PromptMessage, PromptResultMessage]
+
+SessionSnapshot.update_forward_refs()
@@ -0,0 +1,164 @@
+"""
+chat 与 qa 后端共用的资源
+"""
+
+import asyncio
+import logging
+import shlex
+from typing import Awaitable, Callable, Dict
+
+from fastapi import HTTPException
+
+from .models.backend import Backend
+from .settings import ModelConfig, settings
+from .utils.cpuset import AUTO, CpuAllocator, parse_cpus
+from .utils.latency import TimeoutPolicy
+from .utils.memory import MB, MemoryBudget
+from .utils.scheduler import FairScheduler
+from .utils.spawner import SpawnScheduler
+from .utils.transcript import TranscriptRecorder
+from .utils.transports import SubprocessTransport, Transport, UnixSocketTransport
+
+DEFAULT_MODEL = 'default'
+
+# 每个模型配置中，取自 chat_* / qa_* 设置的字段
+_MODEL_FIELDS = ('program', 'args', 'cwd', 'socket', 'cpus', 'threads', 'warmup', 'memory_limit', 'memory_estimate')
+
+
+def _default_model(kind: str) -> ModelConfig:
+    return ModelConfig(**{name: getattr(settings, '{}_{}'.format(kind, name)) for name in _MODEL_FIELDS})
+
+
+# 类别 ("chat" / "qa") => 模型名称 => 模型配置
+models: Dict[str, Dict[str, ModelConfig]] = {  # pylint:disable=invalid-name
+    kind: dict({DEFAULT_MODEL: _default_model(kind)}, **getattr(settings, '{}_models'.format(kind)))
+    for kind in ('chat', 'qa')
+}
+
+# 每个模型各自的预测并发限制
+model_schedulers: Dict[str, FairScheduler] = {  # pylint:disable=invalid-name
+    '{}:{}'.format(kind, name): FairScheduler(config.concurrency)
+    for kind, configs in models.items()
+    for name, config in configs.items()
+}
+
+
+_draining = False
+
+
+def drain():
+    """服务即将关闭：不再新建后端
+    """
+    global _draining  # pylint:disable=global-statement
+    _draining = True
+
+
+def check_accepting():
+    if _draining:
+        raise HTTPException(503, detail='Server shutting down', headers={'Retry-After': '1'})
+
+
+def get_model(kind: str, name: str) -> ModelConfig:
+    try:
+        return models[kind][name]
+    except KeyError:
+        raise HTTPException(404, detail='Unknown {} model "{}"'.format(kind, name))
+
+
+def model_scheduler(kind: str, name: str) -> FairScheduler:
+    return model_schedulers['{}:{}'.format(kind, name)]
+
+
+cpu_allocator = CpuAllocator(settings.cpu_slots)  # pylint:disable=invalid-name
+
+# 在 chat 与 qa 的所有后端之前，限制整台机器上同时进行的预测
+scheduler = FairScheduler(settings.model_concurrency)  # pylint:disable=invalid-name
+
+# 错开后端进程的加载，限制同时加载的进程数
+spawner = SpawnScheduler(settings.spawn_concurrency, settings.spawn_timeout)  # pylint:disable=invalid-name
+
+# 采样各后端的内存用量；本机内存不足以再加载一个后端时拒绝新建
+memory = MemoryBudget(  # pylint:disable=invalid-name
+    settings.memory_headroom * MB,
+    {
+        '{}:{}'.format(kind, name): config.memory_estimate * MB
+        for kind, configs in models.items()
+        for name, config in configs.items()
+    },
+    retry_after=max(1, int(settings.memory_sample_interval)),
+)
+
+# 所有后端共用的自适应超时的参数
+timeout_policy = TimeoutPolicy(  # pylint:disable=invalid-name
+    percentile=settings.timeout_percentile,
+    multiple=settings.timeout_multiple,
+    minimum=settings.timeout_min,
+    maximum=settings.timeout_max,
+    default=settings.timeout_default,
+)
+
+# pylint:disable=invalid-name
+recorder = TranscriptRecorder(settings.transcript_dir) if settings.transcript_dir else None
+
+
+def reserve(kind: str, backend: Backend):
+    """预计内存足够时开始跟踪新建的后端，否则拒绝
+    """
+    memory.reserve('{}:{}'.format(kind, backend.model), backend, check=not backend.socket)
+
+
+def create_transport(backend: Backend, cpus: str = '', threads: int = 0, memory_limit: int = 0) -> Transport:
+    """按照后端的设置创建传输对象，并把分配到的 CPU 记录在 ``backend.cpus``
+
+    :param memory_limit: 子进程地址空间的上限 (MB)，0 表示不限制
+    """
+    if backend.socket:
+        return UnixSocketTransport(backend.socket, reset_input=settings.socket_reset)
+    backend.memory_limit = memory_limit * MB
+    cpus = cpus.strip()
+    if cpus.lower() == AUTO:
+        cpu_set = cpu_allocator.acquire(backend.uid)
+    else:
+        cpu_set = parse_cpus(cpus)
+    backend.cpus = sorted(cpu_set)
+    return SubprocessTransport(
+        backend.program, shlex.split(backend.args), backend.cwd,
+        cpus=cpu_set, threads=threads, memory_limit=backend.memory_limit
+    )
+
+
+def release(backend: Backend):
+    """释放后端占用的资源
+    """
+    cpu_allocator.release(backend.uid)
+    memory.release(backend)
+    spawner.release(backend)
+
+
+async def launch(backend: Backend, interactor, cancelled: Callable[[], bool], on_failure: Callable[[], Awaitable]):
+    """启动后端进程
+
+    有加载名额时直接启动，启动失败的异常交给调用者；否则排队（``backend.queued``），在后台等到名额后再启动。
+    等待期间后端被删除 (``cancelled()`` 返回 ``True``) 或者服务开始关闭时，不再启动。
+    启动失败时释放资源并调用 ``on_failure()``。
+    """
+    async def run(background):
+        try:
+            await spawner.acquire(backend)
+            if _draining or cancelled():
+                release(backend)
+                return
+            await interactor.startup()
+            backend.pid = interactor.proc.pid
+        except BaseException:
+            release(backend)
+            await on_failure()
+            if not background:
+                raise
+            logging.getLogger(__name__).exception('launch %s failed', backend.uid)
+
+    if spawner.has_room():
+        await run(False)
+    else:
+        backend.queued = True
+        asyncio.ensure_future(run(True))
@@ -1,36 +1,43 @@
 import asyncio.subprocess
+import json
 import logging
 import os
 import random
 import shlex
-import signal
 import sys
 from string import Template
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from datetime import datetime
-from functools import partial
-from time import time
-from typing import Any, Dict, List, Tuple, Union
+from functools import lru_cache, partial
+from time import monotonic, time
+from typing import Any, Dict, List, Optional, Tuple, Union
 from uuid import UUID, uuid1
 
-import yaml
-from dateutil.tz import tzlocal
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError, parse_obj_as
 from starlette.responses import Response, StreamingResponse
 from transitions import Machine
 
-from ..models.backend import BackendState
+from .. import pool
+from ..models.backend import BackendState, Priority
 from ..models.chat import (AllMessages, BaseMessage, ChatBackend, Counselor,
                            IncomingMessages, MessageDirection,
                            OutgoingMessages, PromptMessage, PromptBody,
                            PromptResultMessage, PromptResultBody,
-                           PromptResultValue, SuggestMessage,
+                           PromptResultValue, SessionSnapshot, SuggestMessage,
                            SuggestBody, TextMessage)
 from ..settings import settings
 from ..statemachines.chat import FINALS, StateModel, create_machine
+from ..utils.admission import AdmissionController
+from ..utils.clients import client_key
 from ..utils.interactor import Interactor
-
-MAX_BACKENDS = 1
+from ..utils.pubsub import Broadcaster, Subscription
+from ..utils.ratelimit import TokenBucketLimiter
+from ..utils.recommender import CounselorIndex, recent_texts
+from ..utils.scheduler import FairScheduler
+from ..utils.timing import TimedLock, phase, timed_handler
+from ..utils.transcript import session_recorder
 
 router = APIRouter()
 
@@ -40,13 +47,20 @@ class BackendData:
     uid: UUID = None
     backend: ChatBackend = None
     interactor: Interactor = None
-    lock: asyncio.Lock = None
+    lock: asyncio.Lock = None  # 保护状态机与历史记录，只在短临界区中持有
     machine: Machine = None
+    scheduler: FairScheduler = None  # 串行化对模型的预测，按优先级与客户端公平排队
+    reset_pending: bool = False  # 下一次预测前需要清除模型的上下文
+    events: Broadcaster = None  # 推送给 WebSocket 连接的回复与状态变化
 
 
 backends_lock = asyncio.Lock()
 backends: Dict[str, BackendData] = {}
 
+admission = AdmissionController('chat')
+
+rate_limiter = TokenBucketLimiter('chat', settings.chat_rate_limit, settings.chat_rate_burst)
+
 
 @router.get('/', response_model=List[ChatBackend])
 def list_():
@@ -54,28 +68,36 @@ def list_():
 
 
 @router.post('/', status_code=201, response_model=ChatBackend)
-async def create():
+async def create(model: str = pool.DEFAULT_MODEL):
 
     logger = logging.getLogger(__name__)
 
     async def coro_started_condition(uid, name, line):
-        if name.strip().lower() == 'stdout':
-            # 固定一个假的 personality:
-            personality = '您好，我是心理咨询师小媒，有什么可以帮到您？'
-            async with backends_lock:
-                bo = backends[uid]
-            async with bo.lock:
-                bo.backend.personality = personality
-            return True
-        return False
+        async with backends_lock:
+            bo = backends[uid]
+        # 启动过程的输出
+        pool.spawner.output(bo.backend)
+        bo.events.publish({'event': 'output', 'stream': name, 'line': line})
+        return name.strip().lower() == 'stdout'
 
     async def coro_on_started(uid):
         async with backends_lock:
             bo = backends[uid]
+        pool.spawner.started(bo.backend)
         async with bo.lock:
+            # 固定一个假的 personality（连接到已运行的模型服务时，不经过 started_condition）:
+            bo.backend.personality = '您好，我是心理咨询师小媒，有什么可以帮到您？'
             bo.backend.state = BackendState.started
+            if bo.interactor.warmup:
+                # 预热的输入不应留在对话的上下文中
+                bo.reset_pending = True
+        bo.events.publish({'event': 'state', 'state': BackendState.started})
 
     async def coro_on_terminated(uid):
+        pool.release(backend)
+        backend.state = BackendState.terminated
+        events.publish({'event': 'state', 'state': BackendState.terminated})
+        events.close()
         async with backends_lock:
             try:
                 del backends[backend.uid]
@@ -83,12 +105,14 @@ async def create():
                 pass
 
     try:
+        pool.check_accepting()
+        config = pool.get_model('chat', model)
         async with backends_lock:
-            if len(backends) >= MAX_BACKENDS:
+            if sum(1 for bo in backends.values() if bo.backend.model == model) >= config.max_backends:
                 raise HTTPException(
                     status_code=403,
-                    detail='Max length of backends reached: {}'.format(
-                        MAX_BACKENDS
+                    detail='Max length of backends reached for model "{}": {}'.format(
+                        model, config.max_backends
                     )
                 )
 
@@ -96,34 +120,53 @@ async def create():
             uid = uuid1()
             backend = ChatBackend(
                 uid=uid,
-                program=settings.chat_program,
-                args=settings.chat_args,
-                cwd=settings.chat_cwd
-            )
-            logger.info('create Chat backend: %s', backend)
-
-            interactor = Interactor(
-                backend.program, shlex.split(backend.args), backend.cwd,
-                started_condition=partial(coro_started_condition, uid),
-                on_started=coro_on_started(uid),
-                on_terminated=coro_on_terminated(uid),
-            )
-            backends[uid] = BackendData(
-                uid=uid,
-                backend=backend,
-                interactor=interactor,
-                lock=asyncio.Lock(),
-                machine=create_machine(StateModel())
+                model=model,
+                program=config.program,
+                args=config.args,
+                cwd=config.cwd,
+                socket=config.socket,
             )
+            pool.reserve('chat', backend)
+            try:
+                logger.info('create Chat backend: %s', backend)
+                recorder = session_recorder(pool.recorder, uid, 'chat')
+                events = Broadcaster(str(uid))
+                if recorder:
+                    recorder.record('create', backend=backend.dict())
+
+                interactor = Interactor(
+                    backend.program, shlex.split(backend.args), backend.cwd,
+                    started_condition=partial(coro_started_condition, uid),
+                    on_started=coro_on_started(uid),
+                    on_terminated=coro_on_terminated(uid),
+                    transport=pool.create_transport(backend, config.cpus, config.threads, config.memory_limit),
+                    recorder=recorder,
+                    warmup=config.warmup,
+                    warmup_timeout=settings.warmup_timeout,
+                    timeout_policy=pool.timeout_policy,
+                )
+                backends[uid] = BackendData(
+                    uid=uid,
+                    backend=backend,
+                    interactor=interactor,
+                    lock=asyncio.Lock(),
+                    machine=create_machine(StateModel()),
+                    scheduler=FairScheduler(1),
+                    events=events,
+                )
+            except BaseException:
+                # 新建失败（例如 CPU 的设置有误），不能留下内存的预留与分配到的 CPU
+                pool.release(backend)
+                raise
 
-        try:
-            await interactor.startup()
-        except:
+        async def on_failure():
             async with backends_lock:
-                del backends[uid]
-            raise
+                backends.pop(uid, None)
+
+        await pool.launch(backend, interactor, lambda: uid not in backends, on_failure)
+        if backend.queued:
+            logger.info('Backend queued for loading: %s', uid)
         else:
-            backend.pid = interactor.proc.pid
             logger.info('Backend create ok: %s', interactor.proc)
 
         return backend
@@ -157,126 +200,297 @@ async def predict(interactor, txt, timeout=None):
     if not txt:
         raise ValueError('input text can not be empty')
     output_text = await interactor.interact(txt, timeout=timeout)
-    # 清除 > ▁ 的开头的符号
-    output_text = output_text.lstrip('>').lstrip().lstrip('▁').lstrip()
-    # 特殊的规定：半角标点转为全角标点，还有就是 ▁ 换为逗号:
-    for old, new in PUNCTUATION_MAP:
-        output_text = output_text.replace(old, new)
-    return TextMessage(
-        direction=MessageDirection.outgoing,
-        message=output_text,
-        time=datetime.now(tzlocal()),
-    )
+    with phase('postprocess'):
+        # 清除 > ▁ 的开头的符号
+        output_text = output_text.lstrip('>').lstrip().lstrip('▁').lstrip()
+        # 特殊的规定：半角标点转为全角标点，还有就是 ▁ 换为逗号:
+        for old, new in PUNCTUATION_MAP:
+            output_text = output_text.replace(old, new)
+        return TextMessage(
+            direction=MessageDirection.outgoing,
+            message=output_text,
+            time=now(),
+        )
+
+
+def now():
+    # dateutil 只在构造消息时才用到，延迟导入以加快启动
+    from dateutil.tz import tzlocal  # pylint:disable=import-outside-toplevel
+    return datetime.now(tzlocal())
+
+
+def load_yaml(path):
+    # PyYAML 只在读取数据文件时才用到，延迟导入以加快启动
+    import yaml  # pylint:disable=import-outside-toplevel
+    with open(path, encoding='utf8') as fp:
+        return yaml.load(fp, Loader=yaml.SafeLoader)
 
 
 def get_counselors():
-    with open('data/counselors.yml', encoding='utf8') as fp:
-        ds = yaml.load(fp, Loader=yaml.SafeLoader)
+    ds = load_yaml(os.path.join('data', 'counselors.yml'))
     for i in range(len(ds)):
         ds[i]['id'] = i
     return [Counselor(**d) for d in ds]
 
 
+@lru_cache(maxsize=None)
+def get_sentences():
+    # 只在第一次使用时加载回复语句
+    return load_yaml(os.path.join('data', 'sentences.yml'))
+
+
+@lru_cache(maxsize=None)
+def get_counselor_index():
+    # 只在第一次使用时加载咨询师列表并建立索引
+    return CounselorIndex(get_counselors())
+
+
+def scripted_reply(machine, trigger_value=None) -> Optional[BaseMessage]:
+    """根据状态机的当前状态生成脚本化的回复；需要由模型预测时返回 ``None``
+
+    只做状态转移和读取已缓存的数据，不会等待 I/O，可以在短临界区中执行
+    """
+    while True:
+        state = machine.model.state
+        if state == 'dialog':
+            # 通过 ML 模型进行预测
+            return None
+        if state == 'suggest.ask':
+            # 询问是否要推荐咨询老师，从设置文件读取用于回复的语句
+            txt = random.choice(get_sentences()[state])
+            return PromptMessage(message=PromptBody(
+                text=txt, yes_label='推荐', no_label='放弃'
+            ))
+        if state == 'suggest.yes':
+            # 展示推荐的咨询老师
+            counselors = get_counselor_index().recommend(recent_texts(machine.model.history), k=2)
+            return SuggestMessage(
+                direction=MessageDirection.outgoing,
+                message=SuggestBody(
+                    text='为您推荐以下{}位咨询师：'.format(len(counselors)),
+                    counselors=counselors
+                ),
+                time=now()
+            )
+        if state == 'suggest.no':
+            # 拒绝推荐咨询老师
+            machine.model.trigger('')
+            continue
+        if state == 'booked':
+            # 选中了一个咨询老师，回复一个确认信息：从设置文件读取用于回复的语句，返回纯文本消息
+            tpl = Template(random.choice(get_sentences()[state]))
+            counselor = get_counselor_index().get(trigger_value)
+            return TextMessage(
+                direction=MessageDirection.outgoing,
+                message=tpl.substitute(**counselor.dict()),
+                time=now()
+            )
+        # 其它，从设置文件读取用于回复的语句，返回纯文本消息
+        return TextMessage(
+            message=random.choice(get_sentences()[state]),
+            direction=MessageDirection.outgoing,
+            time=now()
+        )
+
+
+async def reset_context_if_pending(bo):
+    """延迟到下一次预测之前才清除模型的上下文，不必等待正在进行的生成（调用者应持有 ``bo.scheduler`` 的位置）
+    """
+    if bo.reset_pending:
+        bo.reset_pending = False
+        await bo.interactor.reset_context()
+
+
+@asynccontextmanager
+async def prediction_slots(bo, priority=Priority.interactive, client=None):
+    """依次获得后端、模型与主机的调度位置
+    """
+    async with TimedLock(bo.scheduler.slot(priority, client), 'backend_lock'), \
+            TimedLock(pool.model_scheduler('chat', bo.backend.model).slot(priority, client), 'model_lock'), \
+            TimedLock(pool.scheduler.slot(priority, client), 'host_lock'):
+        yield
+
+
+async def predict_serialized(bo, txt, timeout, priority=Priority.interactive, client=None):
+    """只有模型预测需要在后端上排队，也只有它需要准入控制：脚本化的回复不因模型的队列过长而被拒绝
+    """
+    with admission.admit(bo.uid, bo.interactor.mean_latency, timeout) as ticket:
+        async with prediction_slots(bo, priority, client):
+            ticket.start()
+            await reset_context_if_pending(bo)
+            return await predict(bo.interactor, txt, timeout=timeout)
+
+
+def reset_session(bo):
+    """重置会话的状态机，并在下一次预测前清除模型的上下文（调用者应持有 ``bo.lock``）
+    """
+    bo.machine = create_machine(StateModel())
+    bo.reset_pending = True
+
+
+async def converse(bo, msg, timeout, stateless=False, priority=Priority.interactive, client=None):
+    """进行一轮对话，返回回复的消息，并推送给这个会话的 WebSocket 连接
+    """
+    logger = logging.getLogger(__name__)
+    timeout = bo.interactor.effective_timeout(timeout)
+    ts = monotonic()
+    recorder = bo.interactor.recorder
+    if recorder:
+        recorder.record('request', msg=msg.dict(), stateless=stateless, timeout=timeout)
+
+    out_msg = None
+    # 短临界区：记录输入，进行状态转移，生成脚本化的回复
+    async with TimedLock(bo.lock, 'state_lock'):
+        machine = bo.machine
+        msg.direction = MessageDirection.incoming
+        machine.model.history.append(msg)
+        if not stateless:
+            # 按照状态机进行交互
+            old_state = machine.model.state
+            msg_body = msg.message
+            # 状态转移！
+            trigger_name = msg.type
+            try:
+                trigger_value = getattr(msg_body, 'value')
+            except AttributeError:
+                trigger_value = None
+                machine.model.trigger(trigger_name)
+            else:
+                machine.model.trigger(trigger_name, trigger_value)
+            logger.debug('%s interact: trigger(%s)[%s==>%s]', bo.interactor.proc,
+                         trigger_name, old_state, machine.model.state)
+            if recorder:
+                recorder.record('transition', trigger=trigger_name, value=trigger_value,
+                                source=old_state, dest=machine.model.state)
+            out_msg = scripted_reply(machine, trigger_value)
+
+    if out_msg is None:
+        # 无状态的交互，或者处于 dialog 状态：通过 ML 模型进行预测
+        if stateless:
+            logger.debug('%s interact stateless', bo.interactor)
+        out_msg = await predict_serialized(bo, msg.message, timeout, priority, client)
+
+    async with TimedLock(bo.lock, 'state_lock'):
+        # 结束了？
+        if not stateless and machine.model.state in FINALS:
+            logger.info('%s interact: final state: %s', bo.interactor.proc, machine.model.state)
+            if bo.machine is machine:
+                reset_session(bo)
+        else:
+            machine.model.history.append(out_msg)
+
+    if recorder:
+        recorder.record('response', msg=out_msg.dict(), state=machine.model.state, elapsed=monotonic() - ts)
+    bo.events.publish({'event': 'message', 'message': out_msg})
+    return out_msg
+
+
 @router.post('/{uid}', response_model=Union[OutgoingMessages, List[OutgoingMessages]])
-async def interact(uid: UUID, msg: IncomingMessages, timeout: float = 15, stateless: bool = False):
+@timed_handler
+async def interact(uid: UUID, msg: IncomingMessages, request: Request, timeout: Optional[float] = None,
+                   stateless: bool = False):
     logger = logging.getLogger(__name__)
+    client = client_key(request, settings.api_keys)
+    rate_limiter.check(client)
     try:
-        async with backends_lock:
+        async with TimedLock(backends_lock, 'backends_lock'):
             try:
                 bo = backends[uid]
             except KeyError:
                 raise HTTPException(404)
 
-        msg.direction = MessageDirection.incoming
-        bo.machine.model.history.append(msg)
-        out_msg = None
-
-        async with bo.lock:
-            if stateless:
-                # 无状态的交互
-                logger.debug('%s interact stateless', bo.interactor)
-                out_msg = await predict(bo.interactor, msg.message, timeout=timeout)
-                bo.machine.model.history.append(out_msg)
-            else:
-                # 按照状态机进行交互
-                old_state = bo.machine.model.state
-                msg_body = msg.message
-                # 状态转移！
-                trigger_name = msg.type
-                try:
-                    trigger_value = getattr(msg_body, 'value')
-                except AttributeError:
-                    bo.machine.model.trigger(trigger_name)
-                else:
-                    bo.machine.model.trigger(trigger_name, trigger_value)
-                logger.debug('%s interact: trigger(%s)[%s==>%s]', bo.interactor.proc,
-                             trigger_name, old_state, bo.machine.model.state)
-                # 输入输出逻辑
-                while not out_msg:
-                    if bo.machine.model.state == 'dialog':
-                        # 通过 ML 模型进行预测
-                        out_msg = await predict(bo.interactor, msg.message, timeout=timeout)
-                    elif bo.machine.model.state == 'suggest.ask':
-                        # 询问是否要推荐咨询老师，从设置文件读取用于回复的语句
-                        with open(os.path.join('data', 'sentences.yml'), encoding='utf8') as fp:
-                            txt_list = yaml.load(fp, Loader=yaml.SafeLoader)[bo.machine.model.state]
-                        txt = random.choice(txt_list)
-                        out_msg = PromptMessage(message=PromptBody(
-                            text=txt, yes_label='推荐', no_label='放弃'
-                        ))
-                    elif bo.machine.model.state == 'suggest.yes':
-                        # 展示推荐的咨询老师
-                        counselors = random.sample(get_counselors(), k=2)
-                        out_msg = SuggestMessage(
-                            direction=MessageDirection.outgoing,
-                            message=SuggestBody(
-                                text='为您推荐以下{}位咨询师：'.format(len(counselors)),
-                                counselors=counselors
-                            ),
-                            time=datetime.now(tzlocal())
-                        )
-                    elif bo.machine.model.state == 'suggest.no':
-                        # 拒绝推荐咨询老师
-                        bo.machine.model.trigger('')
-                    elif bo.machine.model.state == 'booked':
-                        # 选中了一个咨询老师，回复一个确认信息：从设置文件读取用于回复的语句，返回纯文本消息
-                        with open(os.path.join('data', 'sentences.yml'), encoding='utf8') as fp:
-                            txt_list = yaml.load(fp, Loader=yaml.SafeLoader)[bo.machine.model.state]
-                        txt = random.choice(txt_list)
-                        tpl = Template(txt)
-                        counselor = get_counselors()[trigger_value]
-                        txt = tpl.substitute(**counselor.dict())
-                        out_msg = TextMessage(
-                            direction=MessageDirection.outgoing,
-                            message=txt,
-                            time=datetime.now(tzlocal())
-                        )
-                    else:
-                        # 其它，从设置文件读取用于回复的语句，返回纯文本消息
-                        with open(os.path.join('data', 'sentences.yml'), encoding='utf8') as fp:
-                            txt_list = yaml.load(fp, Loader=yaml.SafeLoader)[bo.machine.model.state]
-                        txt = random.choice(txt_list)
-                        out_msg = TextMessage(
-                            message=txt,
-                            direction=MessageDirection.outgoing,
-                            time=datetime.now(tzlocal())
-                        )
-                # end-while
-                # 结束了？
-                if bo.machine.model.state in FINALS:
-                    logger.info('%s interact: final state: %s', bo.interactor.proc, bo.machine.model.state)
-                    await bo.interactor.signal(signal.SIGHUP)
-                    bo.machine = create_machine(StateModel())
-                else:
-                    bo.machine.model.history.append(out_msg)
-
-        return out_msg
+        # 优先级由服务端按路由决定，不能由客户端指定：对话是交互式的
+        return await converse(bo, msg, timeout, stateless, Priority.interactive, client)
 
+    except HTTPException:
+        # 过载时拒绝（503）等是预期的响应，不是未处理的错误
+        raise
     except Exception as err:
         logger.exception('An un-caught error occurred in interact: %s', err)
         raise
 
 
+async def forward_events(websocket: WebSocket, sub: Subscription):
+    async for text in sub:
+        await websocket.send_text(text)
+
+
+async def receive_messages(websocket: WebSocket, bo: BackendData, sub: Subscription,
+                           timeout: Optional[float], stateless: bool):
+    """依次处理连接上收到的消息；回复经由会话的事件推送，错误只发给这个连接
+    """
+    logger = logging.getLogger(__name__)
+    client = client_key(websocket, settings.api_keys)
+    while True:
+        message = await websocket.receive()
+        if message['type'] == 'websocket.disconnect':
+            raise WebSocketDisconnect(message.get('code', 1000))
+        try:
+            try:
+                # 文本帧或者二进制帧都可以
+                data = json.loads(message['text'] if message.get('text') is not None else message.get('bytes') or b'')
+            except ValueError as err:
+                raise HTTPException(400, detail='Invalid JSON: {}'.format(err))
+            rate_limiter.check(client)
+            msg = parse_obj_as(IncomingMessages, data)
+            await converse(bo, msg, timeout, stateless, Priority.interactive, client)
+        except ValidationError as err:
+            sub.send({'event': 'error', 'status': 422, 'detail': err.errors()})
+        except HTTPException as err:
+            sub.send({'event': 'error', 'status': err.status_code, 'detail': err.detail})
+        except Exception as err:  # pylint:disable=broad-except
+            logger.exception('An un-caught error occurred in websocket: %s', err)
+            sub.send({'event': 'error', 'status': 500, 'detail': str(err)})
+
+
+@router.websocket('/{uid}/ws')
+async def websocket_(websocket: WebSocket, uid: UUID, timeout: Optional[float] = None, stateless: bool = False):
+    """会话的 WebSocket 连接
+
+    客户端发送 ``IncomingMessages``；服务端推送 JSON 事件：
+
+    - ``{"event": "state", "state": ...}``：后端的状态，连接建立时先推送一次当前的状态
+    - ``{"event": "output", "stream": ..., "line": ...}``：后端启动过程的输出
+    - ``{"event": "message", "message": ...}``：回复的消息（包括经由 HTTP 接口的交互）
+    - ``{"event": "error", "status": ..., "detail": ...}``：这个连接发送的消息处理失败
+
+    消息不是 JSON 时推送 400 的 ``error`` 事件，连接保持。
+    推送跟不上（积压过多）时，服务端以 1013 关闭连接，客户端可以重连后通过 ``GET /chat/{uid}/history`` 补齐；
+    出现意外的错误时，以 1011 关闭连接。
+    """
+    async with backends_lock:
+        bo = backends.get(uid)
+    if bo is None or bo.events is None:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    with bo.events.subscribe() as sub:
+        sub.send({'event': 'state', 'state': bo.backend.state})
+        sender = asyncio.ensure_future(forward_events(websocket, sub))
+        receiver = asyncio.ensure_future(receive_messages(websocket, bo, sub, timeout, stateless))
+        try:
+            await asyncio.wait([sender, receiver], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sender.cancel()
+            receiver.cancel()
+        failed = False
+        for task in (sender, receiver):
+            if task.done() and not task.cancelled():
+                err = task.exception()
+                if err is not None and not isinstance(err, WebSocketDisconnect):
+                    logging.getLogger(__name__).warning('websocket %s: %r', uid, err)
+                    failed = True
+        if failed:
+            # 不能让客户端一直等待：出错时也要发送关闭帧
+            try:
+                await websocket.close(code=1011)
+            except Exception:  # pylint:disable=broad-except
+                pass  # 连接可能已经断开
+        elif sub.closed and not receiver.done():
+            # 订阅被关闭：后端已经结束，或者推送积压过多
+            await websocket.close(code=1013 if sub.overflowed else 1000)
+
+
 @router.delete('/{uid}')
 async def delete(uid: UUID):
     async with backends_lock:
@@ -285,8 +499,10 @@ async def delete(uid: UUID):
         except KeyError:
             raise HTTPException(404)
 
+    if bo.interactor.recorder:
+        bo.interactor.recorder.record('delete')
     async with bo.lock:
-        bo.interactor.terminate()
+        await bo.interactor.shutdown(settings.shutdown_grace)
 
 
 @router.get('/{uid}/history', response_model=List[AllMessages])
@@ -299,8 +515,8 @@ async def get_history(uid: UUID):
             except KeyError:
                 raise HTTPException(404)
 
-        async with bo.lock:
-            return bo.machine.model.history
+        # 只读取当前的历史记录，不等待锁，因此不会被正在进行的生成阻塞
+        return list(bo.machine.model.history)
     except Exception as err:
         logger.exception('An un-caught error occurred in get_history: %s', err)
         raise
@@ -314,9 +530,70 @@ async def delete_history(uid: UUID):
         except KeyError:
             raise HTTPException(404)
 
+    if bo.interactor.recorder:
+        bo.interactor.recorder.record('reset')
     async with bo.lock:
-        await bo.interactor.signal(signal.SIGHUP)
-        bo.machine = create_machine(StateModel())
+        reset_session(bo)
+
+
+@router.get('/{uid}/snapshot', response_model=SessionSnapshot)
+async def get_snapshot(uid: UUID):
+    """导出会话：状态机的状态与对话历史，用于在其它后端上恢复
+    """
+    async with backends_lock:
+        try:
+            bo = backends[uid]
+        except KeyError:
+            raise HTTPException(404)
+
+    async with bo.lock:
+        model = bo.machine.model
+        return SessionSnapshot(state=model.state, dialog_count=model.dialog_count, history=list(model.history))
+
+
+@router.put('/{uid}/snapshot')
+async def restore_snapshot(uid: UUID, snapshot: SessionSnapshot, request: Request, max_turns: int = 5,
+                           timeout: Optional[float] = None):
+    """在这个后端上恢复会话
+
+    替换状态机的状态与对话历史，清除模型的上下文，然后把历史中最近 ``max_turns`` 条用户输入依次送给模型，以重建模型的上下文；
+    ``max_turns`` 不超过 ``chat_restore_max_turns`` 的设置。
+    重放与对话一样经过限流、准入控制以及后端、模型与主机的调度。
+    """
+    logger = logging.getLogger(__name__)
+    client = client_key(request, settings.api_keys)
+    rate_limiter.check(client)
+    max_turns = min(max_turns, settings.chat_restore_max_turns)
+    async with backends_lock:
+        try:
+            bo = backends[uid]
+        except KeyError:
+            raise HTTPException(404)
+
+    if snapshot.state in FINALS:
+        # 已经结束的会话不能再继续对话
+        raise HTTPException(422, detail='Session in final state {!r} can not be restored'.format(snapshot.state))
+    machine = create_machine(StateModel(dialog_count=snapshot.dialog_count, history=list(snapshot.history)))
+    try:
+        machine.set_state(snapshot.state)
+    except ValueError as err:
+        raise HTTPException(422, detail=str(err))
+
+    timeout = bo.interactor.effective_timeout(timeout)
+    with admission.admit(bo.uid, bo.interactor.mean_latency, timeout) as ticket:
+        if bo.interactor.recorder:
+            bo.interactor.recorder.record('restore', state=snapshot.state, turns=len(snapshot.history))
+        async with bo.lock:
+            bo.machine = machine
+            bo.reset_pending = True
+        texts = recent_texts(snapshot.history, max_turns) if max_turns > 0 else []
+        # 整个重放过程都占着调度位置，其它对话不能插在中间
+        async with prediction_slots(bo, Priority.interactive, client):
+            ticket.start()
+            await reset_context_if_pending(bo)
+            for txt in texts:
+                await predict(bo.interactor, txt, timeout=timeout)
+    logger.info('%s restore: state=%s, replayed %d turns', bo.interactor.proc, snapshot.state, len(texts))
 
 
 @router.get('/{uid}/trace')
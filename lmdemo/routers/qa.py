@@ -2,30 +2,46 @@ import asyncio
 import logging
 import os
 import shlex
-from time import time
-from typing import Dict, List, Tuple
+from time import monotonic, time
+from typing import Dict, List, Optional, Tuple
 from uuid import UUID, uuid1
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from starlette.exceptions import HTTPException
 from starlette.responses import Response, StreamingResponse
 
-from ..models.backend import Backend, BackendState
+from .. import pool
+from ..models.backend import Backend, BackendState, Priority
 from ..models.qa import Answer, Question
 from ..settings import settings
+from ..utils.admission import AdmissionController
+from ..utils.clients import client_key
 from ..utils.interactor import Interactor
-
-MAX_BACKENDS = 1
+from ..utils.ratelimit import TokenBucketLimiter
+from ..utils.scheduler import FairScheduler
+from ..utils.simcache import MinHashLSHCache
+from ..utils.timing import TimedLock, phase, timed_handler
+from ..utils.transcript import session_recorder
 
 router = APIRouter()
 
 backends: Dict[
     str,
-    Tuple[Backend, Interactor, asyncio.Lock]
+    Tuple[Backend, Interactor, asyncio.Lock, FairScheduler]
 ] = {}
 
 backends_lock = asyncio.Lock()
 
+admission = AdmissionController('qa')
+
+rate_limiter = TokenBucketLimiter('qa', settings.qa_rate_limit, settings.qa_rate_burst)
+
+# 不同模型的答案不能混用，每个模型一个缓存
+answer_caches: Dict[str, MinHashLSHCache] = {
+    name: MinHashLSHCache(settings.qa_cache_size, settings.qa_cache_threshold)
+    for name in pool.models['qa']
+}
+
 
 @router.get('/', response_model=List[Backend])
 def list_():
@@ -33,10 +49,11 @@ def list_():
 
 
 @router.post('/', status_code=201, response_model=Backend)
-async def create(wait: float = 0):
+async def create(wait: float = 0, model: str = pool.DEFAULT_MODEL):
     logger = logging.getLogger(__name__)
 
     def func_started_cond(output_file: str, output_text: str) -> bool:
+        pool.spawner.output(backend)
         return output_text.strip().lower().startswith('started')
 
     async def coro_on_started(uid):
@@ -44,48 +61,78 @@ async def create(wait: float = 0):
         logger.info('QA backend started: %s', uid)
         async with backends_lock:
             backend, _, lock, *_ = backends[uid]
+        pool.spawner.started(backend)
         async with lock:
             backend.state = BackendState.started
 
     async def coro_on_terminated(uid):
         logger = logging.getLogger(__name__)
         logger.warning('QA backend terminated: %s', uid)
+        pool.release(backend)
         async with backends_lock:
             try:
                 del backends[uid]
             except KeyError:
                 pass
 
+    pool.check_accepting()
+    config = pool.get_model('qa', model)
     async with backends_lock:
-        if len(backends) >= MAX_BACKENDS:
+        if sum(1 for v in backends.values() if v[0].model == model) >= config.max_backends:
             raise HTTPException(
                 status_code=403,
-                detail='Max length of backends reached: {}'.format(
-                    MAX_BACKENDS)
+                detail='Max length of backends reached for model "{}": {}'.format(
+                    model, config.max_backends)
             )
         uid = uuid1()
         backend = Backend(
             uid=uid,
-            program=settings.qa_program,
-            args=settings.qa_args,
-            cwd=settings.qa_cwd
+            model=model,
+            program=config.program,
+            args=config.args,
+            cwd=config.cwd,
+            socket=config.socket,
         )
-        logger.info('create QA backend: %s', backend)
-
-        interactor = Interactor(
-            backend.program, shlex.split(backend.args), backend.cwd,
-            started_condition=func_started_cond,
-            on_started=coro_on_started(uid),
-            on_terminated=coro_on_terminated(uid),
-        )
-        lock = asyncio.Lock()
-        backends[uid] = (backend, interactor, lock)
-        await interactor.startup()
-        backend.pid = interactor.proc.pid
+        pool.reserve('qa', backend)
+        try:
+            logger.info('create QA backend: %s', backend)
+            recorder = session_recorder(pool.recorder, uid, 'qa')
+            if recorder:
+                recorder.record('create', backend=backend.dict())
+
+            interactor = Interactor(
+                backend.program, shlex.split(backend.args), backend.cwd,
+                started_condition=func_started_cond,
+                on_started=coro_on_started(uid),
+                on_terminated=coro_on_terminated(uid),
+                transport=pool.create_transport(backend, config.cpus, config.threads, config.memory_limit),
+                recorder=recorder,
+                warmup=config.warmup,
+                warmup_timeout=settings.warmup_timeout,
+                timeout_policy=pool.timeout_policy,
+            )
+            lock = asyncio.Lock()
+            # 对模型的预测按优先级与客户端公平排队
+            scheduler = FairScheduler(1)
+            backends[uid] = (backend, interactor, lock, scheduler)
+        except BaseException:
+            # 新建失败（例如 CPU 的设置有误），不能留下内存的预留与分配到的 CPU
+            pool.release(backend)
+            raise
+
+    async def on_failure():
+        async with backends_lock:
+            backends.pop(uid, None)
 
+    await pool.launch(backend, interactor, lambda: uid not in backends, on_failure)
     return backend
 
 
+@router.get('/cache/stats')
+def cache_stats():
+    return {name: cache.stats() for name, cache in answer_caches.items()}
+
+
 @router.get('/{uid}', response_model=Backend)
 async def get(uid: UUID):
     async with backends_lock:
@@ -97,23 +144,52 @@ async def get(uid: UUID):
 
 
 @router.post('/{uid}', response_model=Answer)
-async def interact(uid: UUID, item: Question, timeout: float = 15):
-    async with backends_lock:
+@timed_handler
+async def interact(uid: UUID, item: Question, request: Request, timeout: Optional[float] = None):
+    # 优先级由服务端按路由决定，不能由客户端指定：问答按批量处理，让位于对话
+    priority = Priority.batch
+    client = client_key(request, settings.api_keys)
+    rate_limiter.check(client)
+    async with TimedLock(backends_lock, 'backends_lock'):
         try:
-            backend, interactor, lock, *_ = backends[uid]
+            backend, interactor, _, scheduler, *_ = backends[uid]
         except KeyError:
             raise HTTPException(404)
 
-    async with lock:
-        if backend.state != BackendState.started:
-            raise HTTPException(
-                403, 'Invalid backend state "{}"'.format(backend.state))
-        in_txt = '{title}<sep>{text}<sep><sep><|endoftext|>'.format(
-            **item.dict())
-        out_txt = await interactor.interact(in_txt, timeout=timeout)
-        out_txt = out_txt.lstrip('>').lstrip().lstrip('▁').lstrip()
-        answer = Answer(text=out_txt)
-
+    # 没有指定超时时，由这个后端观察到的耗时决定
+    timeout = interactor.effective_timeout(timeout)
+    ts = monotonic()
+    if interactor.recorder:
+        interactor.recorder.record('request', question=item.dict(), timeout=timeout)
+
+    # 近似重复的问题直接使用缓存的答案，不经过后端
+    answer_cache = answer_caches[backend.model]
+    question_text = '{title}\n{text}'.format(**item.dict())
+    with phase('cache'):
+        answer = answer_cache.get(question_text)
+    if answer is not None:
+        if interactor.recorder:
+            interactor.recorder.record('response', answer=answer.dict(), cached=True, elapsed=monotonic() - ts)
+        return answer
+
+    with admission.admit(uid, interactor.mean_latency, timeout) as ticket:
+        async with TimedLock(scheduler.slot(priority, client), 'backend_lock'), \
+                TimedLock(pool.model_scheduler('qa', backend.model).slot(priority, client), 'model_lock'), \
+                TimedLock(pool.scheduler.slot(priority, client), 'host_lock'):
+            ticket.start()
+            if backend.state != BackendState.started:
+                raise HTTPException(
+                    403, 'Invalid backend state "{}"'.format(backend.state))
+            in_txt = '{title}<sep>{text}<sep><sep><|endoftext|>'.format(
+                **item.dict())
+            out_txt = await interactor.interact(in_txt, timeout=timeout)
+            with phase('postprocess'):
+                out_txt = out_txt.lstrip('>').lstrip().lstrip('▁').lstrip()
+                answer = Answer(text=out_txt)
+            answer_cache.put(question_text, answer)
+
+    if interactor.recorder:
+        interactor.recorder.record('response', answer=answer.dict(), elapsed=monotonic() - ts)
     return answer
 
 
@@ -125,8 +201,10 @@ async def delete(uid: UUID):
         except KeyError:
             raise HTTPException(404)
 
+    if interactor.recorder:
+        interactor.recorder.record('delete')
     async with lock:
-        interactor.terminate()
+        await interactor.shutdown(settings.shutdown_grace)
 
 
 @router.get('/{uid}/trace')
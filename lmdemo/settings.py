@@ -1,9 +1,9 @@
 import logging
 from os import getcwd
-from pprint import pformat
 from sys import executable
+from typing import Dict, List, Set
 
-from pydantic import BaseSettings, Field
+from pydantic import BaseModel, BaseSettings, Field
 
 ENV_PREFIX = 'WEBAPP'
 
@@ -12,6 +12,24 @@ def e(name: str) -> str:
     return '_'.join((ENV_PREFIX, name.strip().strip('_').upper()))
 
 
+class ModelConfig(BaseModel):
+    """一个具名的模型，各字段的含义与 :class:`Settings` 中对应的 ``chat_*`` / ``qa_*`` 设置相同
+    """
+    program: str = executable
+    args: str = ''
+    cwd: str = getcwd()
+    socket: str = ''
+    cpus: str = ''
+    threads: int = 0
+    warmup: List[str] = []
+    memory_limit: int = 0
+    memory_estimate: int = 0
+    # 这个模型同时运行的后端数上限
+    max_backends: int = 1
+    # 这个模型的所有后端同时进行预测的请求数上限；0 表示不限制
+    concurrency: int = 0
+
+
 class Settings(BaseSettings):
     # pylint: disable=too-few-public-methods
     allow_origins: str = Field('*', env=e('allow_origins'))
@@ -19,12 +37,94 @@ class Settings(BaseSettings):
     chat_program: str = Field(executable, env=e('chat_program'))
     chat_args: str = Field('', env=e('chat_args'))
     chat_cwd: str = Field(getcwd(), env=e('chat_cwd'))
+    # 如果设置了，不启动 chat_program 子进程，而是连接到这个 Unix socket 上已经运行的模型服务
+    chat_socket: str = Field('', env=e('chat_socket'))
+    # chat 进程绑定的 CPU，如 "0-3,6"；"auto" 表示从 cpu_slots 份 CPU 中自动分配一份；空表示不绑定
+    chat_cpus: str = Field('', env=e('chat_cpus'))
+    # chat 进程内的并行线程数 (OMP_NUM_THREADS 等)；0 表示与绑定的 CPU 数量相同，不绑定时不设置
+    chat_threads: int = Field(0, env=e('chat_threads'))
+    # 进程启动后、标记为 started 之前依次送给模型的预热输入（JSON 数组，原样写入模型的输入）；空表示不预热
+    chat_warmup: List[str] = Field([], env=e('chat_warmup'))
+    # chat 进程地址空间的上限 (MB, RLIMIT_AS)；0 表示不限制
+    chat_memory_limit: int = Field(0, env=e('chat_memory_limit'))
+    # 一个 chat 后端预计占用的内存 (MB)；0 表示使用已观察到的最大 RSS
+    chat_memory_estimate: int = Field(0, env=e('chat_memory_estimate'))
+
+    # 除了由以上 chat_* 设置构成的 "default" 模型，另外的具名模型（JSON 对象：名称 => ModelConfig）
+    chat_models: Dict[str, ModelConfig] = Field({}, env=e('chat_models'))
 
     qa_program: str = Field(executable, env=e('qa_program'))
     qa_args: str = Field('', env=e('qa_args'))
     qa_cwd: str = Field(getcwd(), env=e('qa_cwd'))
+    # 如果设置了，不启动 qa_program 子进程，而是连接到这个 Unix socket 上已经运行的模型服务
+    qa_socket: str = Field('', env=e('qa_socket'))
+    qa_cpus: str = Field('', env=e('qa_cpus'))
+    qa_threads: int = Field(0, env=e('qa_threads'))
+    qa_warmup: List[str] = Field([], env=e('qa_warmup'))
+    qa_memory_limit: int = Field(0, env=e('qa_memory_limit'))
+    qa_memory_estimate: int = Field(0, env=e('qa_memory_estimate'))
+    qa_models: Dict[str, ModelConfig] = Field({}, env=e('qa_models'))
+    # 连接 Unix socket 模型服务时，清除会话上下文的输入行（服务端对它也回复一行，回复被丢弃）
+    socket_reset: str = Field('/reset', env=e('socket_reset'))
+    # 近似重复问题缓存（每个模型一个）的最大条目数，0 表示不缓存
+    qa_cache_size: int = Field(1024, env=e('qa_cache_size'))
+    # 命中缓存所需的最小相似度 (字符二元与三元组的 Jaccard 相似度)；调低会把只差一个字的不同问题当作重复
+    qa_cache_threshold: float = Field(0.8, env=e('qa_cache_threshold'))
+
+    # 处理时间超过这个值（秒）的请求，记录到慢请求日志
+    slow_request_threshold: float = Field(5, env=e('slow_request_threshold'))
+
+    # 所有后端同时进行预测的请求数上限，按优先级与客户端公平排队；0 表示不限制
+    model_concurrency: int = Field(0, env=e('model_concurrency'))
+
+    # 按 API key（请求头 X-API-Key）区分客户端的 key（JSON 数组）；不在其中的 key 被忽略，按 IP 区分
+    api_keys: Set[str] = Field(set(), env=e('api_keys'))
+
+    # 每个客户端（API key 或 IP）调用模型的限流：每秒补充的次数（0 表示不限流）与突发上限
+    chat_rate_limit: float = Field(0, env=e('chat_rate_limit'))
+    chat_rate_burst: float = Field(10, env=e('chat_rate_burst'))
+    # 恢复 chat 会话时，最多重放的用户输入数（请求的 max_turns 超过它时按它处理）
+    chat_restore_max_turns: int = Field(10, env=e('chat_restore_max_turns'))
+    qa_rate_limit: float = Field(0, env=e('qa_rate_limit'))
+    qa_rate_burst: float = Field(10, env=e('qa_rate_burst'))
+
+    # 每个预热输入的超时（秒）
+    warmup_timeout: float = Field(60, env=e('warmup_timeout'))
+
+    # 请求没有指定超时时，超时取该后端交互耗时 timeout_percentile 分位数的 timeout_multiple 倍，
+    # 限制在 [timeout_min, timeout_max] 之间；样本不足时为 timeout_default（单位均为秒）
+    timeout_percentile: float = Field(0.99, env=e('timeout_percentile'))
+    timeout_multiple: float = Field(3, env=e('timeout_multiple'))
+    timeout_min: float = Field(5, env=e('timeout_min'))
+    timeout_max: float = Field(300, env=e('timeout_max'))
+    timeout_default: float = Field(30, env=e('timeout_default'))
+
+    # 会话记录文件的目录；空表示不记录
+    transcript_dir: str = Field('', env=e('transcript_dir'))
+
+    # 新建后端之后本机至少要保留的可用内存 (MB)，不足时拒绝新建
+    memory_headroom: int = Field(256, env=e('memory_headroom'))
+    # 采样后端内存用量的间隔（秒）
+    memory_sample_interval: float = Field(5, env=e('memory_sample_interval'))
+
+    # 关闭服务时，等待进行中的交互完成的最长时间（秒）
+    drain_timeout: float = Field(30, env=e('drain_timeout'))
+    # 结束后端进程时，SIGTERM 之后等待它退出的时间（秒），超时则 SIGKILL
+    shutdown_grace: float = Field(5, env=e('shutdown_grace'))
+
+    # 同时加载（已启动、尚未匹配 started_condition）的后端进程数上限，其余的排队；0 表示不限制
+    spawn_concurrency: int = Field(1, env=e('spawn_concurrency'))
+    # 一个进程最多占用加载名额的时间（秒），0 表示不限制
+    spawn_timeout: float = Field(600, env=e('spawn_timeout'))
+
+    # "auto" 布局时，把可用 CPU 平均分成的份数
+    cpu_slots: int = Field(2, env=e('cpu_slots'))
 
 
 settings = Settings()  # pylint:disable=invalid-name
 
-logging.getLogger(__name__).info('settings:\n%s', pformat(settings.dict()))
+_logger = logging.getLogger(__name__)
+if _logger.isEnabledFor(logging.INFO):
+    from pprint import pformat
+    _logger.info('settings:\n%s', pformat(settings.dict()))
+del _logger
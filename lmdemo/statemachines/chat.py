@@ -1,41 +1,20 @@
 """
 Chat 的状态机
+
+``transitions.extensions`` 包会一并导入 asyncio、factory、diagrams 等扩展，所以推迟到第一次创建状态机时才导入，
+不占用 Web 应用的启动时间。
 """
 
-import argparse
-from copy import deepcopy
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import List, Optional
 
-from transitions.extensions import (HierarchicalGraphMachine,
-                                    HierarchicalMachine)
-from transitions.extensions.nesting import NestedState
-
 from ..models.chat import BaseMessage
 
-NestedState.separator = '.'
-
-PROMPT_STATEMACHINE = HierarchicalMachine(
-    initial='ask',
-    states=['yes', 'no'],
-    transitions=[
-        dict(trigger='prompt.result', source='ask', dest='yes', conditions=['is_yes']),
-        dict(trigger='prompt.result', source='ask', dest='no'),
-    ],
-)
-
 INITIAL = 'hi'
 
 FINALS = ['bye', 'booked']
 
-STATES = [
-    INITIAL,
-    dict(name='dialog', on_enter='inc_dialog_count'),
-    dict(name='suggest', children=PROMPT_STATEMACHINE),
-    'booked',
-    'bye',
-]
-
 TRANSITIONS = [
     dict(trigger='text', source=INITIAL, dest='dialog'),
     dict(trigger='text', source='dialog', dest='suggest', conditions=['is_dialog_count_gt_zero']),
@@ -44,7 +23,29 @@ TRANSITIONS = [
     dict(trigger='suggest.result', source='suggest.yes', dest='booked'),
 ]
 
-KWARGS = dict(states=STATES, transitions=TRANSITIONS, initial=INITIAL)
+
+@lru_cache(maxsize=None)
+def machine_kwargs() -> dict:
+    # pylint:disable=import-outside-toplevel
+    from transitions.extensions.nesting import HierarchicalMachine, NestedState
+
+    NestedState.separator = '.'
+    prompt_statemachine = HierarchicalMachine(
+        initial='ask',
+        states=['yes', 'no'],
+        transitions=[
+            dict(trigger='prompt.result', source='ask', dest='yes', conditions=['is_yes']),
+            dict(trigger='prompt.result', source='ask', dest='no'),
+        ],
+    )
+    states = [
+        INITIAL,
+        dict(name='dialog', on_enter='inc_dialog_count'),
+        dict(name='suggest', children=prompt_statemachine),
+        'booked',
+        'bye',
+    ]
+    return dict(states=states, transitions=TRANSITIONS, initial=INITIAL)
 
 
 @dataclass
@@ -68,16 +69,24 @@ class StateModel:
 
 
 def create_machine(model):
-    return HierarchicalMachine(model=model, **KWARGS)
+    from transitions.extensions.nesting import HierarchicalMachine  # pylint:disable=import-outside-toplevel
+    return HierarchicalMachine(model=model, **machine_kwargs())
 
 
 def main():
+    # pylint:disable=import-outside-toplevel
+    import argparse
+    from copy import deepcopy
+
+    # 绘图扩展（graphviz）只在这个命令行工具中使用，不要在 Web 应用启动时加载
+    from transitions.extensions import HierarchicalGraphMachine
+
     parser = argparse.ArgumentParser(prog='CMD', description='输出 chat 的状态机图到文件')
     parser.add_argument('output_files', type=str, nargs='+', help='输出文件(*.dot, *.svg, *.png, *.jpg)')
     arguments = parser.parse_args()
 
     # draw the diagram
-    kwargs = deepcopy(KWARGS)
+    kwargs = deepcopy(machine_kwargs())
     kwargs.update({
         'show_conditions': True,
         'show_state_attributes': True
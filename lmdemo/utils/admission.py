@@ -0,0 +1,107 @@
+"""
+准入控制与过载时的提前拒绝
+
+每个后端同一时间只能处理一个请求，其它请求排队等待后端的锁。
+根据该后端排队中和执行中的请求数，以及最近若干次 :meth:`Interactor.interact` 的平均耗时，估算新请求需要等待的时间；
+如果估算时间超过了请求的 ``timeout``，立即以 ``503`` 拒绝，并在 ``Retry-After`` 头中给出建议的重试间隔。
+"""
+
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from math import ceil
+from typing import Hashable, Optional
+
+from fastapi import HTTPException
+
+
+class Ticket:
+    """一个已被准入的请求
+
+    准入后处于“排队”状态，获得后端的锁之后调用 :meth:`start` 转为“执行中”
+    """
+
+    def __init__(self, controller: 'AdmissionController', key: Hashable):
+        self._controller = controller
+        self._key = key
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            self._controller._queued[self._key] -= 1  # pylint:disable=protected-access
+            self._controller._in_flight[self._key] += 1  # pylint:disable=protected-access
+
+    def _finish(self):
+        # pylint:disable=protected-access
+        counter = self._controller._in_flight if self._started else self._controller._queued
+        counter[self._key] -= 1
+        if counter[self._key] <= 0:
+            del counter[self._key]
+
+
+class AdmissionController:
+    def __init__(self, name: str):
+        self._logger = logging.getLogger('{}[{}]'.format(self.__class__.__qualname__, name))
+        self._name = name
+        self._queued = Counter()
+        self._in_flight = Counter()
+        self._admitted = 0
+        self._rejected = 0
+        self._closed = False
+
+    def close(self):
+        """不再准入新的请求（服务关闭前排空时）
+        """
+        self._closed = True
+
+    @property
+    def pending(self) -> int:
+        """排队中与执行中的请求数
+        """
+        return sum(self._queued.values()) + sum(self._in_flight.values())
+
+    def estimate_wait(self, key: Hashable, latency: Optional[float]) -> float:
+        """估算一个新请求在 ``key`` 对应的后端上需要等待的时间（秒）
+        """
+        if not latency:
+            return 0.
+        return (self._queued[key] + self._in_flight[key]) * latency
+
+    @contextmanager
+    def admit(self, key: Hashable, latency: Optional[float], timeout: Optional[float]):
+        """准入一个请求，估算等待时间超过 ``timeout`` 时抛出 ``503`` 的 :class:`HTTPException`
+
+        :param key: 后端的标识
+        :param latency: 该后端最近的平均交互耗时，没有数据时为 ``None``
+        :param timeout: 请求的超时时间，``None`` 表示不限制
+        """
+        if self._closed:
+            self._rejected += 1
+            raise HTTPException(status_code=503, detail='Server shutting down', headers={'Retry-After': '1'})
+        wait = self.estimate_wait(key, latency)
+        if timeout is not None and wait > timeout:
+            self._rejected += 1
+            retry_after = max(1, ceil(wait - timeout))
+            self._logger.warning('reject %s: estimated wait %.1fs > timeout %.1fs', key, wait, timeout)
+            raise HTTPException(
+                status_code=503,
+                detail='Backend overloaded, estimated wait {:.1f}s exceeds timeout {:.1f}s'.format(wait, timeout),
+                headers={'Retry-After': str(retry_after)},
+            )
+        self._admitted += 1
+        self._queued[key] += 1
+        ticket = Ticket(self, key)
+        try:
+            yield ticket
+        finally:
+            ticket._finish()  # pylint:disable=protected-access
+
+    def stats(self) -> dict:
+        return {
+            'name': self._name,
+            'queued': sum(self._queued.values()),
+            'in_flight': sum(self._in_flight.values()),
+            'admitted': self._admitted,
+            'rejected': self._rejected,
+        }
@@ -0,0 +1,18 @@
+from typing import Collection
+
+from starlette.requests import HTTPConnection
+
+API_KEY_HEADER = 'X-API-Key'
+
+
+def client_key(request: HTTPConnection, api_keys: Collection[str] = ()) -> str:
+    """请求方（HTTP 请求或 WebSocket 连接）的标识：API key 在 ``api_keys`` 中时使用它，否则使用客户端的 IP 地址
+
+    API key 没有经过认证，不能信任任意的值：否则客户端每次换一个 key，就能得到新的限流桶与公平队列的份额
+    """
+    api_key = request.headers.get(API_KEY_HEADER)
+    if api_key and api_key in api_keys:
+        return 'key:' + api_key
+    if request.client:
+        return 'ip:' + request.client.host
+    return ''
@@ -0,0 +1,93 @@
+"""
+模型进程的 CPU 亲和性与线程数
+
+同一台只有 CPU 的机器上运行多个 PyTorch 后端时，每个进程默认都会使用全部的核心，互相争抢。
+这里提供：
+
+- 解析形如 ``0-3,6`` 的 CPU 列表
+- 把本进程可用的 CPU 平均分成若干份，按需分配给新建的后端（``auto`` 布局）
+- 限制进程内并行线程数的环境变量
+"""
+
+import os
+from typing import Dict, Hashable, List, Optional, Set
+
+# 常见数值计算库的线程数环境变量
+THREAD_ENV_NAMES = (
+    'OMP_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+)
+
+AUTO = 'auto'
+
+
+def available_cpus() -> Set[int]:
+    try:
+        return set(os.sched_getaffinity(0))
+    except AttributeError:
+        return set(range(os.cpu_count() or 1))
+
+
+def parse_cpus(spec: str) -> Set[int]:
+    """解析 CPU 列表，如 ``"0-3,6"``
+    """
+    result = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            result.update(range(int(first), int(last) + 1))
+        else:
+            result.add(int(part))
+    return result
+
+
+def thread_env(threads: int) -> Dict[str, str]:
+    return {name: str(threads) for name in THREAD_ENV_NAMES}
+
+
+def set_affinity(pid: int, cpus: Set[int]):
+    """设置进程的 CPU 亲和性；不支持的平台上什么也不做
+    """
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(pid, cpus)
+
+
+class CpuAllocator:
+    """把可用的 CPU 平均分为 ``slots`` 份，每个后端占用一份
+    """
+
+    def __init__(self, slots: int, cpus: Optional[Set[int]] = None):
+        cpus = sorted(cpus or available_cpus())
+        slots = max(1, min(slots, len(cpus)))
+        size, extra = divmod(len(cpus), slots)
+        self._slots: List[Set[int]] = []
+        begin = 0
+        for i in range(slots):
+            end = begin + size + (1 if i < extra else 0)
+            self._slots.append(set(cpus[begin:end]))
+            begin = end
+        self._owners: Dict[Hashable, int] = {}
+
+    def acquire(self, owner: Hashable) -> Set[int]:
+        """为 ``owner`` 分配一份 CPU；所有份都被占用时，分配当前占用者最少的一份
+        """
+        if owner in self._owners:
+            return self._slots[self._owners[owner]]
+        usage = [0] * len(self._slots)
+        for i in self._owners.values():
+            usage[i] += 1
+        index = usage.index(min(usage))
+        self._owners[owner] = index
+        return self._slots[index]
+
+    def release(self, owner: Hashable):
+        self._owners.pop(owner, None)
+
+    @property
+    def slots(self) -> List[Set[int]]:
+        return self._slots
@@ -2,15 +2,25 @@ import asyncio.subprocess
 import logging
 import os
 import random
+import signal
 import warnings
 from inspect import isawaitable
-from locale import getpreferredencoding
+from time import monotonic
 from types import SimpleNamespace
 from typing import (Any, Awaitable, Callable, Coroutine, List, Optional,
                     TypeVar, Union)
 
 from fastapi import HTTPException
 
+from .latency import LatencyEstimator, TimeoutPolicy
+from .linereader import DEFAULT_LIMIT, LineReader
+from . import timing
+from .transcript import SessionRecorder
+from .transports import SubprocessTransport, Transport
+
+# 每个预热输入的超时（秒）
+WARMUP_TIMEOUT = 60
+
 # 同步或者异步的回调类型
 Callback = TypeVar('Callback',
                    Callable[..., Any],
@@ -34,6 +44,11 @@ OnOutputCallback = TypeVar('OnOutputCallback',
                            )
 
 
+class ExchangeTimeout(RuntimeError):
+    """在超时之前没有等到模型的输出
+    """
+
+
 class Interactor:
     def __init__(self,
                  proc_program: str,
@@ -43,11 +58,28 @@ class Interactor:
                  on_started: Optional[OnStartedCallback] = None,
                  on_output: Optional[OnOutputCallback] = None,
                  on_terminated: Optional[Callback] = None,
+                 transport: Optional[Transport] = None,
+                 encoding: str = 'utf-8',
+                 line_limit: int = DEFAULT_LIMIT,
+                 recorder: Optional[SessionRecorder] = None,
+                 warmup: Optional[List[str]] = None,
+                 warmup_timeout: float = WARMUP_TIMEOUT,
+                 timeout_policy: Optional[TimeoutPolicy] = None,
                  ):
+        """
+        :param warmup: 匹配 ``started_condition`` 之后、调用 ``on_started`` 之前依次送给模型的预热输入，
+            让模型内部的延迟初始化（内存分配、缓存、JIT 等）不由第一个真正的请求承担
+        :param timeout_policy: 调用者没有指定超时时，如何由观察到的耗时确定 :meth:`interact` 的超时
+        """
         self._logger = logging.getLogger(self.__class__.__qualname__)
         self._proc_program = proc_program
         self._proc_cwd = proc_cwd
         self._proc_args = proc_args or []
+        if transport is None:
+            transport = SubprocessTransport(self._proc_program, self._proc_args, self._proc_cwd)
+        self._transport = transport
+        self._encoding = encoding
+        self._line_limit = line_limit
         self._proc = None
         self._proc_started = False
         self._proc_terminated = False
@@ -61,66 +93,87 @@ class Interactor:
         self._on_terminated: Optional[Callback] = on_terminated
         self._cb_stdout: Optional[Callable[[str], None]] = None
         self._cb_stderr: Optional[Callable[[str], None]] = None
+        # 已经写入、但是没有等到输出（超时或者被取消）的输入数；模型迟到的这些行要丢弃
+        self._stale_lines = 0
         self._input_lock = asyncio.Lock()
+        self._requests = 0
+        self._first_latency: Optional[float] = None
+        self._estimator = LatencyEstimator()
+        self._timeout_policy = timeout_policy or TimeoutPolicy()
+        self._recorder = recorder
+        self._warmup = list(warmup or [])
+        self._warmup_timeout = warmup_timeout
+        self._warmup_latencies: List[float] = []
+        self._warming_up = False
+        self._monitor_task: Optional[asyncio.Future] = None
 
     async def startup(self):
         logger = self._logger
         try:
             try:
-                self._proc = await asyncio.create_subprocess_exec(
-                    self._proc_program,
-                    *self._proc_args,
-                    cwd=self._proc_cwd,
-                    stdin=asyncio.subprocess.PIPE,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                )
+                self._proc = await self._transport.open()
                 logger.info('%s: pending', self._proc)
-                asyncio.ensure_future(self.monitor())
+                self._monitor_task = asyncio.ensure_future(self.monitor())
             except NotImplementedError:
+                # 只有子进程可以退回到 DummySubprocess（事件循环不支持子进程时）；其它传输方式的错误照常抛出
+                if not isinstance(self._transport, SubprocessTransport):
+                    raise
                 warnings.warn(
                     "Current asyncio event loop does not support subprocesses. "
                     "A dummy subprocess will be used. It's ONLY for DEVELOPMENT!",
                 )
                 self._proc = DummySubprocess()
                 self._proc_started = True
-                func = self._on_started
-                if isawaitable(func):
-                    await func
-                elif callable(func):
-                    ret_val = func()
-                    if isawaitable(ret_val):
-                        await ret_val
+                await self._fire(self._on_started)
             return self._proc
         except Exception as err:
             logger.exception('startup: %s', err)
             raise
 
-    async def read_line(self, stream, tag=None):
-        line = await stream.readline()
+    @staticmethod
+    async def _fire(func):
+        # 回调可以是 awaitable 对象，也可以是同步或异步的函数
+        if isawaitable(func):
+            await func
+        elif callable(func):
+            ret_val = func()
+            if isawaitable(ret_val):
+                await ret_val
+
+    async def read_line(self, reader, tag=None):
+        line = await reader.readline()
         return line, tag
 
     async def monitor(self, read_timeout=1, encoding=None):
         logger = self._logger
         proc = self._proc
         try:
-            encoding = encoding or getpreferredencoding()
+            encoding = encoding or self._encoding
+            if self._transport.ready_on_open and not self._proc_started:
+                # 连接到已经运行的模型服务时，无需等待 started_condition
+                self._proc_started = True
+                logger.info('%s: started', proc)
+                await self._fire(self._on_started)
+            readers = {
+                name_tag: LineReader(stream, encoding, self._line_limit)
+                for name_tag, stream in [('stdout', proc.stdout), ('stderr', proc.stderr)]
+                if stream is not None
+            }
+            # 每个流只保持一个读取任务，未完成的任务留到下一轮继续等待
+            tasks = {}
             at_eof = False
             while not at_eof:
-                aws = [
-                    asyncio.ensure_future(self.read_line(stream, name_tag))
-                    for name_tag, stream in [('stdout', proc.stdout), ('stderr', proc.stderr)]
-                ]
-                done, pending = await asyncio.wait(aws, timeout=read_timeout, return_when=asyncio.FIRST_COMPLETED)
-                for task in pending:
-                    task.cancel()
+                for name_tag, reader in readers.items():
+                    if name_tag not in tasks:
+                        tasks[name_tag] = asyncio.ensure_future(self.read_line(reader, name_tag))
+                done, _ = await asyncio.wait(tasks.values(), timeout=read_timeout, return_when=asyncio.FIRST_COMPLETED)
                 for task in done:
-                    result = task.result()
-                    data, name = result
-                    at_eof = data == b''
+                    line, name = task.result()
+                    del tasks[name]
+                    at_eof = line is None
                     if at_eof:
                         break
-                    line = data.decode(encoding).strip()
+                    line = line.strip()
                     logger.debug('%s: %s: %s', proc, name, line)
                     if not self._proc_started:
                         func = self._started_condition
@@ -131,18 +184,21 @@ class Interactor:
                             self._proc_started = bool(ret_val)
                         if self._proc_started:
                             logger.info('%s: started', proc)
-                            func = self._on_started
-                            if isawaitable(func):
-                                await func
-                            elif callable(func):
-                                ret_val = func()
-                                if isawaitable(ret_val):
-                                    await ret_val
+                            if self._warmup:
+                                # 预热需要读取模型的输出，所以不能在这个循环中等待
+                                self._warming_up = True
+                                asyncio.ensure_future(self.warm_up())
+                            else:
+                                await self._fire(self._on_started)
                     # 启动的回调函数
                     if self._proc_started:
                         func = None
                         if name == 'stdout':
-                            func = self._cb_stdout
+                            if self._stale_lines:
+                                self._stale_lines -= 1
+                                logger.warning('%s: discard late output: %s', proc, line)
+                            else:
+                                func = self._cb_stdout
                         elif name == 'stderr':
                             func = self._cb_stderr
                         if callable(func):
@@ -156,23 +212,88 @@ class Interactor:
                         if isawaitable(ret_val):
                             await ret_val
             # end of while
+            for task in tasks.values():
+                task.cancel()
 
             self._proc_terminated = True
             logger.warning('%s: terminated(returncode=%s)', proc, proc.returncode)
 
-            func = self._on_terminated
-            if isawaitable(func):
-                await func
-            elif callable(func):
-                ret_val = func()
-                if isawaitable(ret_val):
-                    await ret_val
+            await self._fire(self._on_terminated)
 
         except Exception as err:
             logger.exception('%s: monitor: %s', proc, err)
             raise
 
-    async def interact(self, input_text: str, timeout=30, encoding=None) -> str:
+    async def warm_up(self):
+        """依次送入预热输入，完成（或失败）后再调用 ``on_started``
+        """
+        logger = self._logger
+        proc = self._proc
+        try:
+            for input_text in self._warmup:
+                ts = monotonic()
+                try:
+                    await self._exchange(input_text, self._warmup_timeout)
+                except Exception as err:  # pylint:disable=broad-except
+                    # 预热只是优化，失败了也照常启动
+                    logger.warning('%s: warm-up: %r', proc, err)
+                    break
+                self._warmup_latencies.append(monotonic() - ts)
+            logger.info('%s: warmed up: %s', proc, ', '.join('{:.3f}s'.format(x) for x in self._warmup_latencies))
+            if self._recorder:
+                self._recorder.record('warmup', latencies=self._warmup_latencies)
+        finally:
+            self._warming_up = False
+        if not self._proc_terminated:
+            await self._fire(self._on_started)
+
+    async def _exchange(self, input_text: str, timeout, encoding=None) -> str:
+        """写入一行输入，等待模型输出一行
+        """
+        proc = self._proc
+        async with self._input_lock:
+            if isinstance(proc, DummySubprocess):
+                await asyncio.sleep(1)
+                return f'Your input: {input_text.strip()}'
+
+            encoding = encoding or self._encoding
+            input_data = f'{input_text.strip()}{os.linesep}'.encode(encoding)
+            fut = asyncio.get_event_loop().create_future()
+            self._cb_stdout = lambda x: fut.set_result(x.strip())
+            written = False
+            try:
+                written_at = monotonic()
+                proc.stdin.write(input_data)
+                written = True
+                drain = asyncio.ensure_future(proc.stdin.drain())
+                drained = []
+                drain.add_done_callback(lambda _: drained.append(monotonic()))
+                aws = [drain, asyncio.ensure_future(fut)]
+                _, pending = await asyncio.wait(aws, timeout=timeout)
+                if pending:
+                    for task in pending:
+                        task.cancel()
+                    raise ExchangeTimeout(
+                        'Following streaming i/o tasks can not be done in %s seconds: %s',
+                        timeout, pending
+                    )
+            finally:
+                self._cb_stdout = None
+                if written and (not fut.done() or fut.cancelled()):
+                    # 模型迟早还会输出这一行，不能把它当作下一个输入的输出
+                    self._stale_lines += 1
+            # 写入 stdin 与等待模型输出的耗时
+            drained_at = drained[0] if drained else written_at
+            timing.add('stdin', drained_at - written_at)
+            timing.add('model', monotonic() - drained_at)
+            return fut.result()
+
+    async def interact(self, input_text: str, timeout: Optional[float] = None, encoding=None) -> str:
+        """送入一行输入，返回模型输出的一行
+
+        :param timeout: 超时（秒）；``None`` 表示使用 :meth:`effective_timeout`
+        """
+        timeout = self.effective_timeout(timeout)
         proc = self._proc
         logger = self._logger
         lock = self._input_lock
@@ -184,61 +305,134 @@ class Interactor:
         if lock.locked():
             raise HTTPException(status_code=409)
 
+        ts = monotonic()
         try:
             logger.debug('%s: interact: input: %s', proc, input_text)
-
-            async with lock:
-                if isinstance(self._proc, asyncio.subprocess.Process):
-                    encoding = encoding or getpreferredencoding()
-                    input_data = f'{input_text.strip()}{os.linesep}'.encode(encoding)
-                    fut = asyncio.get_event_loop().create_future()
-                    self._cb_stdout = lambda x: fut.set_result(x.strip())
-                    try:
-                        proc.stdin.write(input_data)
-                        aws = [
-                            asyncio.ensure_future(m)
-                            for m in (proc.stdin.drain(), fut)
-                        ]
-                        _, pending = await asyncio.wait(aws, timeout=timeout)
-                        if pending:
-                            for task in pending:
-                                task.cancel()
-                            raise RuntimeError(
-                                'Following streaming i/o tasks can not be done in %s seconds: %s',
-                                timeout, pending
-                            )
-                    finally:
-                        self._cb_stdout = None
-                    result = fut.result()
-
-                elif isinstance(self._proc, DummySubprocess):
-                    await asyncio.sleep(1)
-                    result = f'Your input: {input_text.strip()}'
-
-                else:
-                    raise RuntimeError('Un-support asyncio subprocess %r', self._proc)
+            result = await self._exchange(input_text, timeout, encoding)
+            elapsed = monotonic() - ts
+            self._estimator.add(elapsed)
+            self._requests += 1
+            if self._first_latency is None:
+                self._first_latency = elapsed
 
         except Exception as err:
+            if isinstance(err, ExchangeTimeout) and timeout >= (self._estimator.mean or 0):
+                # 超时的交互也要计入：真实的耗时至少是 timeout；只计入成功的样本，超时会被少数快的样本压得越来越短。
+                # 调用者指定的、比平均耗时还短的超时说明不了什么，不能让它把估计拉低
+                self._estimator.add(timeout)
             logger.exception('%s: interact: %s', proc, err)
+            if self._recorder:
+                self._recorder.record('interact', input=input_text, error=repr(err), elapsed=monotonic() - ts)
             raise
 
         logger.debug('%s: interact: output: %s', proc, result)
+        if self._recorder:
+            self._recorder.record('interact', input=input_text, output=result, elapsed=elapsed)
         return result
 
     def terminate(self):
-        self._proc.terminate()
+        try:
+            self._proc.terminate()
+        except ProcessLookupError:
+            pass
+
+    async def shutdown(self, grace: float = 5):
+        """结束后端并等待它退出：先 ``terminate()``，``grace`` 秒内没有退出再 ``kill()``
+
+        Unix socket 连接没有 ``kill()``，关闭连接即可，不会杀死共用的模型服务
+        """
+        proc = self._proc
+        if proc is None:
+            return
+        self.terminate()
+        if await self._wait_exit(grace):
+            return
+        kill = getattr(proc, 'kill', None)
+        if callable(kill):
+            self._logger.warning('%s: not exited in %ss, kill', proc, grace)
+            try:
+                kill()
+            except ProcessLookupError:
+                pass
+            await self._wait_exit(grace)
+
+    async def _wait_exit(self, timeout: float) -> bool:
+        # 等待 monitor 读到 EOF（并调用 on_terminated），以及子进程退出（回收，避免留下僵尸进程）
+        waits = []
+        if self._monitor_task is not None:
+            waits.append(asyncio.shield(self._monitor_task))
+        if callable(getattr(self._proc, 'wait', None)):
+            waits.append(self._proc.wait())
+        try:
+            await asyncio.wait_for(asyncio.gather(*waits, return_exceptions=True), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
 
     async def signal(self, sig):
         async with self._input_lock:
-            os.kill(self._proc.pid, sig)
+            self._proc.send_signal(sig)
+
+    async def reset_context(self):
+        """清除模型的上下文：子进程发送 ``SIGHUP``；共用的模型服务则送入传输方式约定的输入，丢弃它的回复
+        """
+        reset_input = self._transport.reset_input
+        if reset_input is None:
+            await self.signal(signal.SIGHUP)
+        else:
+            await self._exchange(reset_input, self.effective_timeout(None))
 
     @property
     def proc(self):
         return self._proc
 
+    @property
+    def recorder(self) -> Optional[SessionRecorder]:
+        return self._recorder
+
+    @property
+    def transport(self):
+        return self._transport
+
+    @property
+    def mean_latency(self) -> Optional[float]:
+        """交互耗时的估计（秒，EWMA，包括超时的交互），没有数据时为 ``None``
+        """
+        return self._estimator.mean
+
+    def effective_timeout(self, timeout: Optional[float] = None) -> float:
+        """调用者指定了超时时使用它，否则由这个后端的耗时估计决定
+        """
+        if timeout is not None:
+            return timeout
+        return self._timeout_policy.timeout(self._estimator)
+
+    def latency_stats(self) -> dict:
+        """预热、第一个请求与之后（稳定状态）的交互耗时（秒）
+        """
+        return {
+            'warmup': self._warmup_latencies,
+            'first': self._first_latency,
+            # EWMA 中第一个请求的权重很快衰减，稳定之后即是稳定状态的耗时
+            'steady': self._estimator.mean if self._requests > 1 else None,
+            'stdev': self._estimator.stdev,
+            'requests': self._requests,
+            'timeout': self.effective_timeout(),
+        }
+
     @property
     def started(self):
-        return self._proc_started
+        """匹配了 ``started_condition`` 并且完成了预热
+        """
+        return self._proc_started and not self._warming_up
+
+    @property
+    def warmup(self) -> List[str]:
+        return self._warmup
+
+    @property
+    def warming_up(self):
+        return self._warming_up
 
     @property
     def terminated(self):
@@ -267,3 +461,6 @@ class DummySubprocess:
 
     def terminate(self):
         pass
+
+    def send_signal(self, sig):
+        pass
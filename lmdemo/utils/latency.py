@@ -0,0 +1,79 @@
+"""
+由观察到的交互耗时自适应地确定超时
+
+:class:`LatencyEstimator` 用指数加权移动平均 (EWMA) 跟踪耗时的均值与方差，按正态分布近似估计分位数，每个样本只需常数时间。
+:class:`TimeoutPolicy` 把分位数乘以一个倍数作为超时：模型卡死能被很快发现，较慢但正常的生成也不会被误杀。
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from math import erf, sqrt
+from typing import Optional
+
+
+@lru_cache(maxsize=None)
+def normal_quantile(p: float) -> float:
+    """标准正态分布的 ``p`` 分位数（二分求解，结果会被缓存）
+    """
+    lo, hi = -10., 10.
+    for _ in range(60):
+        mid = (lo + hi) / 2
+        if (1 + erf(mid / sqrt(2))) / 2 < p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+class LatencyEstimator:
+    def __init__(self, alpha: float = 0.2):
+        """
+        :param alpha: 新样本的权重，越大越快地跟上耗时的变化
+        """
+        self._alpha = alpha
+        self._mean = 0.
+        self._var = 0.
+        self._count = 0
+
+    def add(self, seconds: float):
+        self._count += 1
+        if self._count == 1:
+            self._mean = seconds
+            return
+        diff = seconds - self._mean
+        incr = self._alpha * diff
+        self._mean += incr
+        self._var = (1 - self._alpha) * (self._var + diff * incr)
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self._mean if self._count else None
+
+    @property
+    def stdev(self) -> Optional[float]:
+        return sqrt(self._var) if self._count else None
+
+    def quantile(self, p: float) -> Optional[float]:
+        if not self._count:
+            return None
+        return self._mean + normal_quantile(p) * sqrt(self._var)
+
+
+@dataclass
+class TimeoutPolicy:
+    percentile: float = 0.99  # 使用耗时的哪个分位数
+    multiple: float = 3.  # 超时是该分位数的多少倍
+    minimum: float = 5.
+    maximum: float = 300.
+    default: float = 30.  # 样本不足时的超时
+    min_samples: int = 3
+
+    def timeout(self, estimator: LatencyEstimator) -> float:
+        if estimator.count < self.min_samples:
+            return self.default
+        value = estimator.quantile(self.percentile) * self.multiple
+        return min(self.maximum, max(self.minimum, value))
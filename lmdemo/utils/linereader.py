@@ -0,0 +1,95 @@
+"""
+按块读取、增量解码的行读取器
+
+与 :meth:`asyncio.StreamReader.readline` 相比：
+
+- 没有 64KiB 的默认长度限制导致的 ``ValueError`` / ``LimitOverrunError``：超长的行会被截断到 ``limit`` 个字符，而不是让 monitor 异常退出。
+- 使用增量解码器，被分割在两次读取之间的多字节字符可以被正确解码；无法解码的字节用替换字符代替。
+- 解码器在构造时确定，不会对每一行重新查找编码。
+"""
+
+import codecs
+import logging
+from collections import deque
+from typing import Optional
+
+DEFAULT_LIMIT = 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class LineReader:
+    def __init__(self, stream, encoding: str = 'utf-8',
+                 limit: int = DEFAULT_LIMIT, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        :param stream: :class:`asyncio.StreamReader` 或者具有 ``async read(n)`` 方法的对象
+        :param encoding: 文本编码
+        :param limit: 每一行最多保留的字符数，超出部分被丢弃
+        :param chunk_size: 每次从 ``stream`` 读取的最大字节数
+        """
+        if limit < 1:
+            raise ValueError('limit must be greater than zero')
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._stream = stream
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self._limit = limit
+        self._chunk_size = chunk_size
+        self._lines = deque()
+        self._pieces = []
+        self._pieces_len = 0
+        self._overflowed = False
+        self._eof = False
+        self._truncated_count = 0
+
+    async def readline(self) -> Optional[str]:
+        """读取一行（不含换行符），到达 EOF 时返回 ``None``
+        """
+        while not self._lines:
+            if self._eof:
+                return None
+            data = await self._stream.read(self._chunk_size)
+            if data:
+                self._feed(self._decoder.decode(data))
+            else:
+                self._eof = True
+                self._feed(self._decoder.decode(b'', final=True))
+                if self._pieces or self._overflowed:
+                    self._flush()
+        return self._lines.popleft()
+
+    def _feed(self, text: str):
+        pos = 0
+        while True:
+            idx = text.find('\n', pos)
+            if idx < 0:
+                self._append(text[pos:])
+                break
+            self._append(text[pos:idx])
+            self._flush()
+            pos = idx + 1
+
+    def _append(self, piece: str):
+        room = self._limit - self._pieces_len
+        if len(piece) > room:
+            piece = piece[:room]
+            self._overflowed = True
+        if piece:
+            self._pieces.append(piece)
+            self._pieces_len += len(piece)
+
+    def _flush(self):
+        line = ''.join(self._pieces)
+        if self._overflowed:
+            self._truncated_count += 1
+            self._logger.warning('line longer than %d characters truncated', self._limit)
+        self._lines.append(line)
+        self._pieces = []
+        self._pieces_len = 0
+        self._overflowed = False
+
+    @property
+    def truncated_count(self) -> int:
+        return self._truncated_count
+
+    @property
+    def at_eof(self) -> bool:
+        return self._eof and not self._lines
@@ -0,0 +1,140 @@
+"""
+后端进程的内存用量
+
+每个模型进程要占用数 GB 内存。这里提供：
+
+- 从 ``/proc`` 读取进程的常驻内存 (RSS) 与本机的可用内存
+- 子进程启动后，用 ``RLIMIT_AS`` 限制它的地址空间
+- :class:`MemoryBudget`：定期采样各后端的 RSS；新建后端前估算它和仍在加载中的后端还要占用的内存，
+  超出本机可用内存时拒绝新建，而不是等着 OOM killer 杀掉一个正在服务的后端
+"""
+
+import asyncio
+import logging
+import os
+from typing import Dict, Hashable, Optional, Tuple
+
+from fastapi import HTTPException
+
+from ..models.backend import Backend, BackendState
+
+MB = 1 << 20
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError):
+    PAGE_SIZE = 4096
+
+
+def read_rss(pid: int) -> int:
+    """进程的常驻内存（字节）；进程不存在或者不支持的平台上返回 0
+    """
+    try:
+        with open('/proc/{}/statm'.format(pid)) as fp:
+            return int(fp.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def available_memory() -> Optional[int]:
+    """本机的可用内存（字节），即 ``/proc/meminfo`` 的 ``MemAvailable``；无法读取时返回 ``None``
+    """
+    try:
+        with open('/proc/meminfo') as fp:
+            for line in fp:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def set_memory_limit(pid: int, limit: int):
+    """限制进程的地址空间 (``RLIMIT_AS``)；不支持的平台上什么也不做
+
+    注意限制的是虚拟内存，通常要比实际的 RSS 宽松得多
+    """
+    if limit <= 0:
+        return
+    try:
+        import resource  # pylint:disable=import-outside-toplevel
+        prlimit = resource.prlimit
+    except (ImportError, AttributeError):
+        return
+    prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+
+
+class MemoryBudget:
+    def __init__(self, headroom: int = 0, estimates: Optional[Dict[str, int]] = None, retry_after: int = 30):
+        """
+        :param headroom: 新建后端之后，本机至少还要保留的可用内存（字节）
+        :param estimates: 各类后端的预计内存用量（字节）；没有设置时，使用已经观察到的同类后端的最大 RSS
+        :param retry_after: 拒绝新建时，建议客户端重试的间隔（秒）
+        """
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._headroom = headroom
+        self._estimates = {k: v for k, v in (estimates or {}).items() if v > 0}
+        self._retry_after = retry_after
+        # uid => (类别, 后端)
+        self._backends: Dict[Hashable, Tuple[str, Backend]] = {}
+        self._peaks: Dict[str, int] = {}
+        self._refused = 0
+
+    def estimate(self, kind: str) -> int:
+        return self._estimates.get(kind, self._peaks.get(kind, 0))
+
+    def reserve(self, kind: str, backend: Backend, check: bool = True):
+        """预计内存足够时开始跟踪 ``backend``，否则抛出 ``503`` 的 :class:`HTTPException`
+
+        :param check: 为 ``False`` 时只跟踪，不检查（例如连接到已经运行的模型服务，不会占用新的内存）
+        """
+        available = available_memory() if check else None
+        if available is not None:
+            # 仍在加载中的后端，还会增长到预计的用量
+            growing = sum(
+                max(0, self.estimate(k) - b.rss)
+                for k, b in self._backends.values()
+                if b.state == BackendState.pending
+            )
+            needed = self.estimate(kind)
+            if available - growing - needed < self._headroom:
+                self._refused += 1
+                self._logger.warning(
+                    'refuse %s backend: available %dMB, loading %dMB, needed %dMB, headroom %dMB',
+                    kind, available // MB, growing // MB, needed // MB, self._headroom // MB
+                )
+                raise HTTPException(
+                    status_code=503,
+                    detail='Not enough memory for a new {} backend'.format(kind),
+                    headers={'Retry-After': str(self._retry_after)},
+                )
+        self._backends[backend.uid] = (kind, backend)
+
+    def release(self, backend: Backend):
+        self._backends.pop(backend.uid, None)
+
+    def sample(self):
+        """采样所有后端的 RSS，写入 ``backend.rss``
+        """
+        for kind, backend in list(self._backends.values()):
+            if not backend.pid:
+                continue
+            backend.rss = read_rss(backend.pid)
+            if backend.rss > self._peaks.get(kind, 0):
+                self._peaks[kind] = backend.rss
+
+    async def run(self, interval: float):
+        while True:
+            try:
+                self.sample()
+            except Exception as err:  # pylint:disable=broad-except
+                self._logger.exception('sample: %s', err)
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        return {
+            'available': available_memory(),
+            'rss': sum(b.rss for _, b in self._backends.values()),
+            'estimates': {k: self.estimate(k) for k in set(self._estimates) | set(self._peaks)},
+            'refused': self._refused,
+        }
@@ -0,0 +1,106 @@
+"""
+向多个订阅者推送事件
+
+每个事件只序列化一次，再放入各个订阅者的有界队列。订阅者空闲时只有一个等待中的队列，不占用其它资源。
+某个订阅者的队列满了（消费太慢）时，它的订阅会被关闭，而不是阻塞发布者或者无限积压。
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+
+DEFAULT_QUEUE_SIZE = 64
+
+_CLOSED = object()
+
+
+def dumps(event: Any) -> str:
+    return json.dumps(jsonable_encoder(event), ensure_ascii=False, separators=(',', ':'))
+
+
+class Subscription:
+    def __init__(self, broadcaster: 'Broadcaster', maxsize: int):
+        self._broadcaster = broadcaster
+        # 多留一个位置，用于放入关闭标记
+        self._queue = asyncio.Queue(maxsize + 1)
+        self._maxsize = maxsize
+        self._closed = False
+        self.overflowed = False
+
+    def put(self, text: str):
+        """放入一个已序列化的事件；队列已满时关闭这个订阅
+        """
+        if self._closed:
+            return
+        if self._queue.qsize() >= self._maxsize:
+            self.overflowed = True
+            self.close()
+            return
+        self._queue.put_nowait(text)
+
+    def send(self, event: Any):
+        """只推送给这个订阅者的事件
+        """
+        self.put(dumps(event))
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put_nowait(_CLOSED)
+        self._broadcaster.discard(self)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        item = await self._queue.get()
+        if item is _CLOSED:
+            raise StopAsyncIteration
+        return item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class Broadcaster:
+    def __init__(self, name: str = '', queue_size: int = DEFAULT_QUEUE_SIZE):
+        self._logger = logging.getLogger('{}[{}]'.format(self.__class__.__qualname__, name))
+        self._queue_size = queue_size
+        self._subscriptions: Set[Subscription] = set()
+
+    def subscribe(self, queue_size: Optional[int] = None) -> Subscription:
+        sub = Subscription(self, queue_size or self._queue_size)
+        self._subscriptions.add(sub)
+        return sub
+
+    def discard(self, sub: Subscription):
+        self._subscriptions.discard(sub)
+        if sub.overflowed:
+            self._logger.warning('subscriber overflowed, closed')
+
+    def publish(self, event: Any):
+        if not self._subscriptions:
+            return
+        text = dumps(event)
+        for sub in list(self._subscriptions):
+            sub.put(text)
+
+    def close(self):
+        """关闭所有订阅
+        """
+        for sub in list(self._subscriptions):
+            sub.close()
+
+    def __len__(self):
+        return len(self._subscriptions)
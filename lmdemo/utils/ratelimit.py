@@ -0,0 +1,79 @@
+"""
+按客户端的令牌桶限流
+
+每个客户端一个令牌桶：以 ``rate`` 个/秒的速度补充，最多积累 ``burst`` 个，每个请求消耗一个。
+令牌不足时以 ``429`` 拒绝，并在响应头中给出可以重试的时间。
+
+每次检查只需常数时间；最多保留 ``max_clients`` 个客户端的桶，超出时淘汰最久没有请求的客户端（它的桶一定已经补满或接近补满）。
+"""
+
+import logging
+from collections import OrderedDict
+from math import ceil
+from time import monotonic
+from typing import Hashable, Tuple
+
+from fastapi import HTTPException
+
+
+class TokenBucketLimiter:
+    def __init__(self, name: str, rate: float, burst: float, max_clients: int = 10000):
+        """
+        :param rate: 每秒补充的令牌数，不大于 0 表示不限流
+        :param burst: 桶的容量
+        """
+        self._logger = logging.getLogger('{}[{}]'.format(self.__class__.__qualname__, name))
+        self._name = name
+        self._rate = rate
+        self._burst = max(1., burst)
+        self._max_clients = max_clients
+        self._buckets: 'OrderedDict[Hashable, Tuple[float, float]]' = OrderedDict()
+        self._allowed = 0
+        self._throttled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._rate > 0
+
+    def check(self, client: Hashable):
+        """为 ``client`` 消耗一个令牌；令牌不足时抛出 ``429`` 的 :class:`HTTPException`
+        """
+        if not self.enabled:
+            return
+        now = monotonic()
+        tokens, ts = self._buckets.pop(client, (self._burst, now))
+        tokens = min(self._burst, tokens + (now - ts) * self._rate)
+        if tokens >= 1:
+            tokens -= 1
+            self._allowed += 1
+            self._store(client, tokens, now)
+            return
+        self._store(client, tokens, now)
+        self._throttled += 1
+        reset = (1 - tokens) / self._rate
+        self._logger.info('throttle %s: retry after %.2fs', client, reset)
+        raise HTTPException(
+            status_code=429,
+            detail='Too many requests, retry after {:.1f}s'.format(reset),
+            headers={
+                'Retry-After': str(max(1, ceil(reset))),
+                'X-RateLimit-Limit': '{:g}'.format(self._burst),
+                'X-RateLimit-Remaining': '0',
+                'X-RateLimit-Reset': '{:.3f}'.format(reset),
+            },
+        )
+
+    def _store(self, client: Hashable, tokens: float, ts: float):
+        self._buckets[client] = (tokens, ts)
+        if len(self._buckets) > self._max_clients:
+            self._buckets.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            'name': self._name,
+            'rate': self._rate,
+            'burst': self._burst,
+            'clients': len(self._buckets),
+            'allowed': self._allowed,
+            'throttled': self._throttled,
+        }
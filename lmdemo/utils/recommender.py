@@ -0,0 +1,77 @@
+"""
+根据对话内容推荐咨询师
+
+加载时，从 :attr:`Counselor.tags` 建立倒排索引：标签（以及标签的字符二元组）==> 咨询师。
+推荐时，只查找对话文本中出现的二元组，所以耗时与文本长度相关，几乎不随咨询师数量增长。
+"""
+
+import random
+from collections import defaultdict
+from heapq import nlargest
+from math import log
+from typing import Dict, Iterable, List, Sequence, Set
+
+from ..models.chat import BaseMessage, Counselor, MessageDirection, TextMessage
+
+
+def bigrams(text: str) -> Set[str]:
+    text = ''.join(text.split())
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i+2] for i in range(len(text) - 1)}
+
+
+class CounselorIndex:
+    def __init__(self, counselors: Sequence[Counselor]):
+        self._counselors = list(counselors)
+        self._by_id = {c.id: c for c in self._counselors}
+        postings: Dict[str, Set[int]] = defaultdict(set)
+        for counselor in self._counselors:
+            for tag in counselor.tags:
+                for key in bigrams(tag):
+                    postings[key].add(counselor.id)
+        # 出现越普遍的二元组，权重越低 (idf)
+        total = len(self._counselors) or 1
+        self._postings: Dict[str, List[int]] = {k: sorted(v) for k, v in postings.items()}
+        self._weights: Dict[str, float] = {k: 1 + log(total / len(v)) for k, v in postings.items()}
+
+    @property
+    def counselors(self) -> List[Counselor]:
+        return self._counselors
+
+    def get(self, id_: int) -> Counselor:
+        return self._by_id[id_]
+
+    def score(self, text: str) -> Dict[int, float]:
+        scores: Dict[int, float] = defaultdict(float)
+        for key in bigrams(text):
+            ids = self._postings.get(key)
+            if ids:
+                weight = self._weights[key]
+                for id_ in ids:
+                    scores[id_] += weight
+        return scores
+
+    def recommend(self, texts: Iterable[str], k: int = 2) -> List[Counselor]:
+        """按照文本与标签的匹配程度，返回得分最高的 ``k`` 位咨询师；匹配不足 ``k`` 位时随机补足
+        """
+        scores = self.score(' '.join(texts))
+        ids = nlargest(k, scores, key=lambda id_: (scores[id_], -id_))
+        result = [self._by_id[id_] for id_ in ids]
+        if len(result) < k:
+            rest = [c for c in self._counselors if c.id not in scores]
+            result.extend(random.sample(rest, k=min(k - len(result), len(rest))))
+        return result
+
+
+def recent_texts(history: Sequence[BaseMessage], turns: int = 5) -> List[str]:
+    """从对话历史中取出最近 ``turns`` 条用户输入的文本
+    """
+    result = []
+    for msg in reversed(history):
+        if len(result) >= turns:
+            break
+        if isinstance(msg, TextMessage) and msg.direction == MessageDirection.incoming:
+            result.append(msg.message)
+    result.reverse()
+    return result
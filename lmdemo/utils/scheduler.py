@@ -0,0 +1,139 @@
+"""
+按优先级类别与客户端加权公平排队
+
+取代简单的 :class:`asyncio.Lock`：等待使用模型的请求按 ``(类别, 客户端)`` 分成若干队列。
+每次有空闲的位置时：
+
+- 在有等待请求的类别之间按权重进行步幅调度（stride scheduling）：类别每被服务一次，它的“虚拟时间”增加 ``1 / 权重``，
+  选择虚拟时间最小的类别。交互式请求的权重远高于批量请求，因此批量请求再多，交互式请求最多只需等待正在执行的那一个请求。
+- 同一类别内，在不同客户端之间轮转，一个客户端的大量请求不会阻塞其它客户端。
+"""
+
+import asyncio
+from collections import OrderedDict, deque
+from typing import Dict, Hashable, Optional
+
+DEFAULT_WEIGHTS = {
+    'interactive': 8.,
+    'batch': 1.,
+}
+
+
+class FairScheduler:
+    def __init__(self, concurrency: int = 1, weights: Optional[Dict[Hashable, float]] = None):
+        """
+        :param concurrency: 同时执行的请求数上限，不大于 0 表示不限制
+        :param weights: 各优先级类别的权重
+        """
+        self._concurrency = concurrency
+        self._weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        # 类别 => 客户端 => 等待中的 future
+        self._queues: Dict[Hashable, 'OrderedDict[Hashable, deque]'] = {}
+        self._passes: Dict[Hashable, float] = {}
+        self._vtime = 0.
+        self._running = 0
+        self._waiting = 0
+
+    def slot(self, priority: Hashable, client: Hashable = None) -> 'Slot':
+        return Slot(self, priority, client)
+
+    def _has_room(self) -> bool:
+        return self._concurrency <= 0 or self._running < self._concurrency
+
+    def _charge(self, priority: Hashable):
+        weight = self._weights.get(priority, 1.)
+        # 空闲过的类别从当前虚拟时间开始计算，不能积累之前的额度
+        self._vtime = max(self._passes.get(priority, 0.), self._vtime)
+        self._passes[priority] = self._vtime + 1. / weight
+
+    async def acquire(self, priority: Hashable, client: Hashable = None):
+        if self._has_room() and not self._waiting:
+            self._running += 1
+            self._charge(priority)
+            return
+        fut = asyncio.get_event_loop().create_future()
+        clients = self._queues.setdefault(priority, OrderedDict())
+        clients.setdefault(client, deque()).append(fut)
+        self._waiting += 1
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 已经分配到了位置，但调用者被取消了
+                self.release()
+            else:
+                self._discard(priority, client, fut)
+            raise
+
+    def release(self):
+        self._running -= 1
+        self._dispatch()
+
+    def _discard(self, priority: Hashable, client: Hashable, fut: asyncio.Future):
+        clients = self._queues.get(priority)
+        if not clients or client not in clients:
+            return
+        try:
+            clients[client].remove(fut)
+        except ValueError:
+            return
+        self._waiting -= 1
+        if not clients[client]:
+            del clients[client]
+        if not clients:
+            del self._queues[priority]
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._waiting and self._has_room():
+            priority = min(self._queues, key=lambda k: self._passes.get(k, self._vtime))
+            clients = self._queues[priority]
+            # 客户端之间轮转：取出第一个客户端的请求后，把它移到末尾
+            client, futs = next(iter(clients.items()))
+            fut = futs.popleft()
+            self._waiting -= 1
+            if futs:
+                clients.move_to_end(client)
+            else:
+                del clients[client]
+            if not clients:
+                del self._queues[priority]
+            if fut.done():
+                continue
+            self._running += 1
+            self._charge(priority)
+            fut.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            'running': self._running,
+            'waiting': self._waiting,
+            'queues': {
+                str(priority): sum(len(v) for v in clients.values())
+                for priority, clients in self._queues.items()
+            },
+        }
+
+
+class Slot:
+    """调度器中的一个位置，具有与锁相同的 ``acquire()`` / ``release()`` 接口，可以直接用于 ``async with``
+    """
+
+    def __init__(self, scheduler: FairScheduler, priority: Hashable, client: Hashable = None):
+        self._scheduler = scheduler
+        self._priority = priority
+        self._client = client
+
+    async def acquire(self):
+        await self._scheduler.acquire(self._priority, self._client)
+        return True
+
+    def release(self):
+        self._scheduler.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
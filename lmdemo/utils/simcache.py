@@ -0,0 +1,163 @@
+"""
+近似重复问题的缓存
+
+用字符 n-gram 的 MinHash 签名和 LSH 分桶索引过去的问题，
+新问题与某个已缓存问题的 Jaccard 相似度不低于阈值时，直接返回缓存的答案。
+
+字符相似度分辨不出只差一个字的不同问题，所以默认的阈值很保守，只命中标点、语气词等细微的差别；
+换一种说法的同一个问题通常不会命中，但也不会把别的问题的答案返回给用户::
+
+    >>> round(jaccard(shingles('我失眠怎么办？'), shingles('我失眠怎么办啊')), 2)
+    0.82
+    >>> round(jaccard(shingles('我失眠怎么办'), shingles('我失恋怎么办')), 2)
+    0.29
+    >>> round(jaccard(shingles('我失眠怎么办'), shingles('失眠了怎么办呢')), 2)
+    0.25
+    >>> cache = MinHashLSHCache()
+    >>> cache.put('最近晚上总是失眠，应该怎么办', 'A')
+    >>> cache.get('最近晚上总是失眠应该怎么办呢'), cache.get('最近晚上总是失恋，应该怎么办')
+    ('A', None)
+
+缓存的条目数有上限，超出时淘汰最久未命中的条目。
+"""
+
+import random
+import re
+import unicodedata
+import zlib
+from collections import OrderedDict, defaultdict
+from time import monotonic
+from typing import Any, Dict, FrozenSet, Hashable, Optional, Set, Tuple
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_IGNORED = re.compile(r'\s+')
+
+DEFAULT_NGRAMS = (2, 3)
+DEFAULT_THRESHOLD = 0.8
+
+
+def normalize(text: str) -> str:
+    """去掉空白与标点，统一全角/半角与大小写
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = _IGNORED.sub('', text)
+    return ''.join(c for c in text if not unicodedata.category(c).startswith('P'))
+
+
+def shingles(text: str, ngrams: Tuple[int, ...] = DEFAULT_NGRAMS) -> FrozenSet[str]:
+    text = normalize(text)
+    result = set()
+    for n in ngrams:
+        result.update(text[i:i+n] for i in range(len(text) - n + 1))
+    if not result and text:
+        # 比最短的 n-gram 还短的文本，整个作为一个元素
+        result.add(text)
+    return frozenset(result)
+
+
+def jaccard(a: Set, b: Set) -> float:
+    if not a and not b:
+        return 1.
+    return len(a & b) / len(a | b)
+
+
+class MinHashLSHCache:
+    def __init__(self, capacity: int = 1024, threshold: float = DEFAULT_THRESHOLD,
+                 num_perm: int = 64, bands: int = 32, ngrams: Tuple[int, ...] = DEFAULT_NGRAMS, seed: int = 1):
+        """
+        :param capacity: 最多缓存的条目数
+        :param threshold: 命中需要的最小 Jaccard 相似度
+        :param num_perm: MinHash 签名的长度，必须能被 ``bands`` 整除
+        :param bands: LSH 的分段数；分段越多（每段越短），越容易召回相似度较低的候选
+        :param ngrams: 使用的字符 n-gram 的长度
+        """
+        if num_perm % bands:
+            raise ValueError('num_perm must be divisible by bands')
+        self._capacity = capacity
+        self._threshold = threshold
+        self._bands = bands
+        self._rows = num_perm // bands
+        self._ngrams = ngrams
+        rnd = random.Random(seed)
+        self._perms = [
+            (rnd.randrange(1, _MERSENNE_PRIME), rnd.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+        # key => (shingles, band keys, value)
+        self._entries: 'OrderedDict[Hashable, Tuple[FrozenSet[str], Tuple[Hashable, ...], Any]]' = OrderedDict()
+        self._buckets: Dict[Hashable, Set[Hashable]] = defaultdict(set)
+        self._lookups = 0
+        self._hits = 0
+        self._lookup_seconds = 0.
+
+    def _band_keys(self, items: FrozenSet[str]) -> Tuple[Hashable, ...]:
+        hashes = [zlib.crc32(s.encode('utf-8')) for s in items] or [0]
+        signature = [
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes) & _MAX_HASH
+            for a, b in self._perms
+        ]
+        rows = self._rows
+        return tuple(
+            (i, tuple(signature[i*rows:(i+1)*rows]))
+            for i in range(self._bands)
+        )
+
+    def get(self, text: str) -> Optional[Any]:
+        """返回与 ``text`` 足够相似的已缓存问题的值，没有时返回 ``None``
+        """
+        ts = monotonic()
+        self._lookups += 1
+        try:
+            items = shingles(text, self._ngrams)
+            candidates = set()
+            for band_key in self._band_keys(items):
+                candidates.update(self._buckets.get(band_key, ()))
+            best_key, best_score = None, self._threshold
+            for key in candidates:
+                score = jaccard(items, self._entries[key][0])
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                return None
+            self._hits += 1
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key][2]
+        finally:
+            self._lookup_seconds += monotonic() - ts
+
+    def put(self, text: str, value: Any):
+        if self._capacity <= 0:
+            return
+        key = normalize(text)
+        if key in self._entries:
+            self._remove(key)
+        items = shingles(text, self._ngrams)
+        band_keys = self._band_keys(items)
+        self._entries[key] = (items, band_keys, value)
+        for band_key in band_keys:
+            self._buckets[band_key].add(key)
+        while len(self._entries) > self._capacity:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable):
+        _, band_keys, _ = self._entries.pop(key)
+        for band_key in band_keys:
+            bucket = self._buckets[band_key]
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[band_key]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'capacity': self._capacity,
+            'lookups': self._lookups,
+            'hits': self._hits,
+            'hit_rate': self._hits / self._lookups if self._lookups else 0.,
+            'mean_lookup_ms': self._lookup_seconds * 1000 / self._lookups if self._lookups else 0.,
+        }
@@ -0,0 +1,125 @@
+"""
+错开后端进程的加载
+
+同时新建多个后端时，如果所有模型进程一起加载 checkpoint，磁盘读取与内存会同时达到峰值，每个都更慢，还可能耗尽内存。
+:class:`SpawnScheduler` 限制同时处于加载中（已经启动、还没有匹配 ``started_condition``）的进程数，其余的依次排队。
+
+加载进度按启动过程的输出行数估算：以同一个程序（相同的 ``program`` 与 ``args``）上一次启动到匹配 ``started_condition`` 时输出的行数为 100%。
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Hashable, Optional
+
+from ..models.backend import Backend
+
+
+def _program_key(backend: Backend) -> Hashable:
+    return backend.program, backend.args, backend.socket
+
+
+class SpawnScheduler:
+    def __init__(self, concurrency: int = 1, timeout: float = 0):
+        """
+        :param concurrency: 同时加载的进程数上限，不大于 0 表示不限制
+        :param timeout: 一个进程最多占用加载名额的时间（秒），超时后即使还没有启动完成，也让下一个进程开始加载；0 表示不限制
+        """
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._concurrency = concurrency
+        self._timeout = timeout
+        # uid => 超时的 handle
+        self._loading: Dict[Hashable, Optional[asyncio.Handle]] = {}
+        self._waiters: deque = deque()
+        # uid => 到目前为止的输出行数
+        self._lines: Dict[Hashable, int] = {}
+        # 程序 => 上一次启动完成时的输出行数
+        self._expected: Dict[Hashable, int] = {}
+        self._started = 0
+        self._timed_out = 0
+
+    def has_room(self) -> bool:
+        """现在就可以开始加载，无需排队
+        """
+        return not self._waiters and (self._concurrency <= 0 or len(self._loading) < self._concurrency)
+
+    async def acquire(self, backend: Backend):
+        """等待一个加载名额
+        """
+        if self.has_room():
+            self._start(backend)
+            return
+        fut = asyncio.get_event_loop().create_future()
+        self._waiters.append((backend, fut))
+        backend.queued = True
+        self._logger.info('queue %s: %d loading, %d waiting', backend.uid, len(self._loading), len(self._waiters))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(backend)
+            else:
+                self._waiters = deque(x for x in self._waiters if x[1] is not fut)
+                backend.queued = False
+            raise
+
+    def _start(self, backend: Backend):
+        backend.queued = False
+        backend.progress = 0.
+        handle = None
+        if self._timeout > 0:
+            handle = asyncio.get_event_loop().call_later(self._timeout, self._expire, backend)
+        self._loading[backend.uid] = handle
+        self._lines[backend.uid] = 0
+
+    def _expire(self, backend: Backend):
+        if backend.uid in self._loading:
+            self._timed_out += 1
+            self._logger.warning('%s: still loading after %ss, let the next one start', backend.uid, self._timeout)
+            self._loading[backend.uid] = None
+            self.release(backend)
+
+    def output(self, backend: Backend):
+        """加载过程中的一行输出
+        """
+        if backend.uid not in self._lines:
+            return
+        self._lines[backend.uid] += 1
+        expected = self._expected.get(_program_key(backend))
+        if expected:
+            backend.progress = min(0.99, self._lines[backend.uid] / expected)
+
+    def started(self, backend: Backend):
+        """后端已经启动：记录这次的输出行数，用于估算以后的进度，并释放名额
+        """
+        lines = self._lines.get(backend.uid)
+        if lines:
+            self._expected[_program_key(backend)] = lines
+        backend.progress = 1.
+        self._started += 1
+        self.release(backend)
+
+    def release(self, backend: Backend):
+        """释放 ``backend`` 的加载名额（可以重复调用）
+        """
+        self._lines.pop(backend.uid, None)
+        if backend.uid not in self._loading:
+            return
+        handle = self._loading.pop(backend.uid)
+        if handle is not None:
+            handle.cancel()
+        while self._waiters and (self._concurrency <= 0 or len(self._loading) < self._concurrency):
+            waiter, fut = self._waiters.popleft()
+            if fut.done():
+                continue
+            self._start(waiter)
+            fut.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            'concurrency': self._concurrency,
+            'loading': len(self._loading),
+            'waiting': len(self._waiters),
+            'started': self._started,
+            'timed_out': self._timed_out,
+        }
@@ -0,0 +1,109 @@
+"""
+请求处理各阶段的耗时
+
+每个 HTTP 请求开始时由中间件调用 :func:`start` 创建一个 :class:`Timings` 并放入上下文变量，
+处理过程中的代码用 :func:`phase` / :func:`add` / :class:`TimedLock` 记录各阶段的耗时（没有当前请求时什么也不做）。
+中间件在响应头 ``Server-Timing`` 中返回这些耗时。
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import monotonic
+from typing import Optional
+
+_current: ContextVar = ContextVar('timings', default=None)
+
+
+class Timings:
+    def __init__(self):
+        self._begin = monotonic()
+        self._phases = OrderedDict()
+        self._handler_done: Optional[float] = None
+
+    def add(self, name: str, seconds: float):
+        """累加一个阶段的耗时（同名阶段出现多次时相加）
+        """
+        self._phases[name] = self._phases.get(name, 0.) + seconds
+
+    def handler_done(self):
+        self._handler_done = monotonic()
+
+    def finish(self):
+        """请求处理完毕：记录序列化（路由函数返回之后）的耗时与总耗时
+        """
+        now = monotonic()
+        if self._handler_done is not None:
+            self.add('serialize', now - self._handler_done)
+        self._phases['total'] = now - self._begin
+
+    @property
+    def phases(self) -> 'OrderedDict[str, float]':
+        return self._phases
+
+    @property
+    def total(self) -> float:
+        return self._phases.get('total', monotonic() - self._begin)
+
+    def header(self) -> str:
+        return ', '.join('{};dur={:.1f}'.format(name, seconds * 1000) for name, seconds in self._phases.items())
+
+
+def start() -> Timings:
+    timings = Timings()
+    _current.set(timings)
+    return timings
+
+
+def current() -> Optional[Timings]:
+    return _current.get()
+
+
+def add(name: str, seconds: float):
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def phase(name: str):
+    ts = monotonic()
+    try:
+        yield
+    finally:
+        add(name, monotonic() - ts)
+
+
+class TimedLock:
+    """记录等待锁的耗时::
+
+        async with TimedLock(lock, 'backends_lock'):
+            ...
+    """
+
+    def __init__(self, lock, name: str):
+        self._lock = lock
+        self._name = name
+
+    async def __aenter__(self):
+        with phase(self._name):
+            await self._lock.acquire()
+        return self._lock
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._lock.release()
+
+
+def timed_handler(func):
+    """标记路由函数返回的时间，之后到响应完成的时间计为序列化耗时
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            timings = _current.get()
+            if timings is not None:
+                timings.handler_done()
+    return wrapper
@@ -0,0 +1,70 @@
+"""
+会话记录
+
+把每个会话的输入、输出、耗时和状态转移按行写入本地的 JSON Lines 文件，用于离线分析，以及通过 ``scripts/replay.py`` 重放真实的流量。
+
+每一行是一个事件::
+
+    {"ts":1576800000.123,"sid":"<session uid>","kind":"chat","ev":"request",...}
+"""
+
+import json
+import logging
+import os
+from datetime import datetime
+from time import time
+from typing import Any, Optional
+
+
+class TranscriptRecorder:
+    def __init__(self, directory: str):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._directory = directory
+        self._fp = None
+
+    def _open(self):
+        os.makedirs(self._directory, exist_ok=True)
+        file_name = 'transcript-{:%Y%m%d%H%M%S}-{}.jsonl'.format(datetime.now(), os.getpid())
+        path = os.path.join(self._directory, file_name)
+        self._logger.info('record transcripts to %s', path)
+        # 行缓冲：每个事件写完即落盘，进程意外退出时也不会丢失
+        return open(path, 'a', encoding='utf-8', buffering=1)
+
+    def record(self, session: Any, kind: str, event: str, **data):
+        item = {'ts': round(time(), 3), 'sid': str(session), 'kind': kind, 'ev': event}
+        item.update((k, round(v, 4) if isinstance(v, float) else v) for k, v in data.items())
+        try:
+            if self._fp is None:
+                self._fp = self._open()
+            self._fp.write(json.dumps(item, ensure_ascii=False, separators=(',', ':'), default=str))
+            self._fp.write('\n')
+        except Exception as err:  # pylint:disable=broad-except
+            # 记录失败不能影响正常的请求处理
+            self._logger.error('record: %s', err)
+
+    def session(self, session: Any, kind: str) -> 'SessionRecorder':
+        return SessionRecorder(self, session, kind)
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+class SessionRecorder:
+    """绑定到一个会话的记录器
+    """
+
+    def __init__(self, recorder: TranscriptRecorder, session: Any, kind: str):
+        self._recorder = recorder
+        self._session = session
+        self._kind = kind
+
+    def record(self, event: str, **data):
+        self._recorder.record(self._session, self._kind, event, **data)
+
+
+def session_recorder(recorder: Optional[TranscriptRecorder], session: Any, kind: str) -> Optional[SessionRecorder]:
+    if recorder is None:
+        return None
+    return recorder.session(session, kind)
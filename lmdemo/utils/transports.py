@@ -0,0 +1,167 @@
+"""
+Interactor 与模型程序之间的传输方式
+
+每个传输对象的 ``open()`` 方法返回一个“类进程”对象，它具有与 :class:`asyncio.subprocess.Process` 相同的以下成员：
+
+- ``stdin``: 写入输入的 :class:`asyncio.StreamWriter`
+- ``stdout``, ``stderr``: 读取输出的 :class:`asyncio.StreamReader` （``stderr`` 可以是 ``None``）
+- ``pid``, ``returncode``
+- ``terminate()``, ``send_signal(sig)``
+"""
+
+import asyncio.subprocess
+import logging
+from abc import ABC, abstractmethod
+import os
+import socket
+import struct
+from typing import List, Optional, Set
+
+from .cpuset import set_affinity, thread_env
+from .memory import set_memory_limit
+
+
+class Transport(ABC):
+    """传输方式的基类
+    """
+
+    # ``open()`` 成功后，是否直接认为后端已经启动（不再等待 started_condition）
+    ready_on_open = False
+    # 清除模型上下文的输入行；``None`` 表示向进程发送 ``SIGHUP``
+    reset_input: Optional[str] = None
+
+    @abstractmethod
+    async def open(self):
+        """建立连接，返回“类进程”对象
+        """
+
+
+class SubprocessTransport(Transport):
+    """启动一个子进程，通过 stdin/stdout/stderr 管道交互
+
+    可以把子进程绑定到 ``cpus`` 指定的 CPU 上，并通过环境变量限制其并行线程数为 ``threads``
+    （``threads`` 为 0 时，使用 ``cpus`` 的数量）；``memory_limit`` 不为 0 时限制子进程的地址空间（字节）
+    """
+
+    def __init__(self, program: str, args: Optional[List[str]] = None, cwd: str = '',
+                 cpus: Optional[Set[int]] = None, threads: int = 0, memory_limit: int = 0):
+        self._program = program
+        self._args = args or []
+        self._cwd = cwd
+        self._cpus = set(cpus or ())
+        self._threads = threads or len(self._cpus)
+        self._memory_limit = memory_limit
+
+    async def open(self):
+        env = None
+        if self._threads:
+            env = dict(os.environ, **thread_env(self._threads))
+        proc = await asyncio.create_subprocess_exec(
+            self._program,
+            *self._args,
+            cwd=self._cwd or None,
+            env=env,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            # 模型程序的计算线程在 Python 解释器启动之后才会创建，它们会继承这里设置的亲和性
+            set_affinity(proc.pid, self._cpus)
+            # 同样，模型的权重在解释器启动之后才加载
+            set_memory_limit(proc.pid, self._memory_limit)
+        except BaseException:
+            # 调用者拿不到这个进程，不能让它在后台继续运行
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+            raise
+        return proc
+
+    @property
+    def cpus(self) -> Set[int]:
+        return self._cpus
+
+    def __repr__(self):
+        return '<{} program={!r}>'.format(self.__class__.__name__, self._program)
+
+
+class UnixSocketTransport(Transport):
+    """连接到一个已经在本机运行的模型服务的 Unix domain socket
+
+    模型服务进程的生命周期与 Web 进程无关：多个 Web 进程可以共用长期运行的模型服务，Web 服务重启时也不必重新加载模型。
+
+    服务端约定：每个连接是一个独立的会话，每行输入对应一行输出；收到 ``reset_input`` 时只清除这个连接的会话上下文。
+    """
+
+    def __init__(self, path: str, ready_on_open: bool = True, reset_input: str = '/reset'):
+        self._path = path
+        self.ready_on_open = ready_on_open
+        self.reset_input = reset_input
+
+    async def open(self):
+        reader, writer = await asyncio.open_unix_connection(self._path)
+        return UnixSocketConnection(self._path, reader, writer)
+
+    def __repr__(self):
+        return '<{} path={!r}>'.format(self.__class__.__name__, self._path)
+
+
+class UnixSocketConnection:
+    """Unix socket 连接的“类进程”包装
+    """
+
+    def __init__(self, path: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._path = path
+        self._reader = reader
+        self._writer = writer
+        self._pid = peer_pid(writer.get_extra_info('socket'))
+        self._closed = False
+
+    @property
+    def stdin(self):
+        return self._writer
+
+    @property
+    def stdout(self):
+        return self._reader
+
+    @property
+    def stderr(self):
+        return None
+
+    @property
+    def pid(self):
+        return self._pid
+
+    @property
+    def returncode(self):
+        return 0 if self._closed else None
+
+    def terminate(self):
+        """关闭连接；不会结束对端的模型服务进程
+        """
+        if not self._closed:
+            self._closed = True
+            self._writer.close()
+
+    def send_signal(self, sig):
+        """忽略：对端的模型服务进程由多个连接共用，向它发送信号会影响所有会话
+        """
+        logging.getLogger(self.__class__.__qualname__).warning('%s: signal %s ignored', self, sig)
+
+    def __repr__(self):
+        return '<{} path={!r} pid={}>'.format(self.__class__.__name__, self._path, self._pid)
+
+
+def peer_pid(sock) -> int:
+    """通过 ``SO_PEERCRED`` 获取 Unix socket 对端进程的 pid，不支持时返回 0
+    """
+    try:
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    except (AttributeError, OSError):
+        return 0
+    pid, *_ = struct.unpack('3i', creds)
+    return pid
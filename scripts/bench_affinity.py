@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+多个模型进程并发计算时，CPU 绑定布局与默认（超额订阅）配置的总吞吐量对比
+
+在项目目录运行::
+
+    python scripts/bench_affinity.py --workers 4 --duration 10
+
+每个工作进程反复做矩阵乘法（优先使用 PyTorch，其次 NumPy），输出完成的次数。
+``default`` 模式下每个进程都使用全部核心；``pinned`` 模式下按 :class:`lmdemo.utils.cpuset.CpuAllocator` 的布局绑定 CPU 并限制线程数。
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint:disable=wrong-import-position
+from lmdemo.utils.cpuset import CpuAllocator  # noqa: E402
+from lmdemo.utils.transports import SubprocessTransport  # noqa: E402
+
+WORKER = '''
+import sys
+from time import perf_counter
+size, duration = int(sys.argv[1]), float(sys.argv[2])
+try:
+    import torch
+    a = torch.rand(size, size)
+    matmul = lambda: a @ a
+except ImportError:
+    import numpy
+    a = numpy.random.rand(size, size).astype('float32')
+    matmul = lambda: a @ a
+matmul()
+count, ts = 0, perf_counter()
+while perf_counter() - ts < duration:
+    matmul()
+    count += 1
+print(count / (perf_counter() - ts))
+'''
+
+
+async def run(workers, size, duration, pinned):
+    allocator = CpuAllocator(workers)
+    transports = [
+        SubprocessTransport(
+            sys.executable, ['-c', WORKER, str(size), str(duration)],
+            cpus=allocator.acquire(i) if pinned else None
+        )
+        for i in range(workers)
+    ]
+    procs = await asyncio.gather(*(t.open() for t in transports))
+    outputs = await asyncio.gather(*(p.communicate() for p in procs))
+    rates = []
+    for proc, (stdout, stderr) in zip(procs, outputs):
+        if proc.returncode:
+            raise RuntimeError(stderr.decode())
+        rates.append(float(stdout.decode().strip()))
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较 CPU 绑定布局与默认配置的总吞吐量')
+    parser.add_argument('--workers', type=int, default=2, help='并发的工作进程数 (default: %(default)s)')
+    parser.add_argument('--size', type=int, default=512, help='矩阵边长 (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=5, help='每个进程的计算时间（秒） (default: %(default)s)')
+    arguments = parser.parse_args()
+
+    for mode in ('default', 'pinned'):
+        rates = asyncio.run(run(arguments.workers, arguments.size, arguments.duration, mode == 'pinned'))
+        print('{:<8} total={:8.1f} matmul/s per-worker={}'.format(
+            mode, sum(rates), ' '.join('{:.1f}'.format(r) for r in rates)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+后端输出行读取器的吞吐量基准测试
+
+在项目目录运行::
+
+    python scripts/bench_linereader.py --lines 20000 --line-chars 2000
+
+把生成的多字节文本按随机大小的块喂给 :class:`asyncio.StreamReader`，
+比较 :class:`lmdemo.utils.linereader.LineReader` 与 ``StreamReader.readline()`` + ``bytes.decode()`` 的吞吐量。
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lmdemo.utils.linereader import LineReader  # noqa: E402 pylint:disable=wrong-import-position
+
+SAMPLE = '我最近总是失眠，晚上睡不着，白天没有精神，怎么办？Hello, world! ▁'
+
+
+def make_payload(lines, line_chars):
+    text = (SAMPLE * (line_chars // len(SAMPLE) + 1))[:line_chars]
+    return ((text + '\n') * lines).encode('utf-8')
+
+
+def make_stream(payload, max_chunk):
+    stream = asyncio.StreamReader(limit=2 ** 30)
+    pos = 0
+    while pos < len(payload):
+        size = random.randint(1, max_chunk)
+        stream.feed_data(payload[pos:pos + size])
+        pos += size
+    stream.feed_eof()
+    return stream
+
+
+async def run_linereader(stream):
+    reader = LineReader(stream)
+    count = 0
+    while await reader.readline() is not None:
+        count += 1
+    return count
+
+
+async def run_readline(stream):
+    count = 0
+    while True:
+        data = await stream.readline()
+        if not data:
+            break
+        data.decode('utf-8').rstrip('\n')
+        count += 1
+    return count
+
+
+async def measure(func, payload, max_chunk):
+    stream = make_stream(payload, max_chunk)
+    ts = perf_counter()
+    count = await func(stream)
+    return count, perf_counter() - ts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较行读取器的吞吐量')
+    parser.add_argument('--lines', type=int, default=10000, help='行数 (default: %(default)s)')
+    parser.add_argument('--line-chars', type=int, default=1000, help='每行字符数 (default: %(default)s)')
+    parser.add_argument('--max-chunk', type=int, default=4096, help='每次喂入的最大字节数 (default: %(default)s)')
+    arguments = parser.parse_args()
+
+    payload = make_payload(arguments.lines, arguments.line_chars)
+    mb = len(payload) / 1024 / 1024
+    for name, func in [('LineReader', run_linereader), ('StreamReader.readline', run_readline)]:
+        count, elapsed = asyncio.run(measure(func, payload, arguments.max_chunk))
+        print('{:<24} {:>8} lines {:8.1f} MiB/s'.format(name, count, mb / elapsed))
+
+
+if __name__ == '__main__':
+    main()
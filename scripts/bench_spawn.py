@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+测量同时新建多个后端时，全部可用所需的时间
+
+在运行中的 Web 服务上同时新建 ``-n`` 个后端，轮询它们的状态直到全部 ``started``，输出每个后端可用的时间与总时间。
+分别以不同的 ``WEBAPP_SPAWN_CONCURRENCY`` 启动 Web 服务并运行，即可比较错开加载与同时加载::
+
+    python scripts/bench_spawn.py --url http://127.0.0.1:8090 --kind qa --model default -n 3
+
+注意：模型的 ``max_backends`` 要不小于 ``-n``。
+"""
+
+import argparse
+import json
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def request(url, method, path, timeout=60):
+    req = urllib.request.Request(url.rstrip('/') + path, method=method)
+    with urllib.request.urlopen(req, timeout=timeout) as res:
+        content = res.read()
+    return json.loads(content) if content else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量同时新建多个后端时，全部可用所需的时间')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Web 服务的地址 (default: %(default)s)')
+    parser.add_argument('--kind', choices=('chat', 'qa'), default='qa', help='后端的类别 (default: %(default)s)')
+    parser.add_argument('--model', default='default', help='模型的名称 (default: %(default)s)')
+    parser.add_argument('-n', type=int, default=2, help='新建的后端数 (default: %(default)s)')
+    parser.add_argument('--wait', type=float, default=1800, help='最多等待的时间（秒） (default: %(default)s)')
+    arguments = parser.parse_args()
+
+    begin = time.time()
+    with ThreadPoolExecutor(arguments.n) as executor:
+        backends = list(executor.map(
+            lambda _: request(arguments.url, 'POST', '/{}/?model={}'.format(arguments.kind, arguments.model)),
+            range(arguments.n)
+        ))
+    ready = {}
+    try:
+        while len(ready) < len(backends):
+            if time.time() - begin > arguments.wait:
+                print('not all backends started in {}s'.format(arguments.wait), file=sys.stderr)
+                break
+            for backend in backends:
+                if backend['uid'] in ready:
+                    continue
+                backend = request(arguments.url, 'GET', '/{}/{}'.format(arguments.kind, backend['uid']))
+                if backend['state'] == 'started':
+                    ready[backend['uid']] = time.time() - begin
+            time.sleep(0.2)
+    finally:
+        for backend in backends:
+            request(arguments.url, 'DELETE', '/{}/{}'.format(arguments.kind, backend['uid']))
+    for i, seconds in enumerate(sorted(ready.values())):
+        print('backend {} ready at {:.1f}s'.format(i + 1, seconds))
+    if ready:
+        print('time to capacity: {:.1f}s, mean time to ready: {:.1f}s'.format(
+            max(ready.values()), sum(ready.values()) / len(ready)))
+
+
+if __name__ == '__main__':
+    main()
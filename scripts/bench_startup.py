@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Web 应用启动（导入）耗时的基准测试
+
+在项目目录运行::
+
+    python scripts/bench_startup.py -n 20 --max-ms 500
+    python scripts/bench_startup.py -n 20 --baseline HEAD~1
+
+每一轮都启动一个新的 Python 解释器执行 ``import lmdemo.app``，统计耗时。
+如果指定了 ``--max-ms`` 且中位数超过该值，以非零状态码退出，便于在 CI 中跟踪。
+如果指定了 ``--baseline``，还会把该 git 版本检出到临时的工作树，与当前代码交替测量，输出两者中位数的差。
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+CODE = '''
+from time import perf_counter
+ts = perf_counter()
+import {module}
+print(perf_counter() - ts)
+'''
+
+
+def measure(module, cwd):
+    output = subprocess.check_output(
+        [sys.executable, '-c', CODE.format(module=module)],
+        cwd=cwd, env=dict(os.environ, PYTHONDONTWRITEBYTECODE='')
+    )
+    return float(output.decode().strip().splitlines()[-1]) * 1000
+
+
+def summary(name, samples):
+    return '{}: n={} min={:.1f}ms median={:.1f}ms max={:.1f}ms'.format(
+        name, len(samples), min(samples), statistics.median(samples), max(samples)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量导入 Web 应用的耗时')
+    parser.add_argument('-n', '--number', type=int, default=10, help='测量的轮数 (default: %(default)s)')
+    parser.add_argument('-m', '--module', default='lmdemo.app', help='要导入的模块 (default: %(default)s)')
+    parser.add_argument('--max-ms', type=float, default=None, help='中位数耗时的上限（毫秒）')
+    parser.add_argument('--baseline', default=None, help='与之比较的 git 版本，如 HEAD~1')
+    arguments = parser.parse_args()
+
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    dirs = {'current': cwd}
+    if arguments.baseline:
+        dirs['baseline'] = tempfile.mkdtemp(prefix='bench_startup_')
+        subprocess.check_call(
+            ['git', 'worktree', 'add', '--detach', dirs['baseline'], arguments.baseline],
+            cwd=cwd, stdout=subprocess.DEVNULL
+        )
+    try:
+        for path in dirs.values():
+            measure(arguments.module, path)  # 预热：生成字节码缓存
+        samples = {name: [] for name in dirs}
+        # 交替测量，避免机器负载的变化只影响其中一个
+        for _ in range(arguments.number):
+            for name, path in dirs.items():
+                samples[name].append(measure(arguments.module, path))
+    finally:
+        if arguments.baseline:
+            subprocess.call(['git', 'worktree', 'remove', '--force', dirs['baseline']], cwd=cwd)
+    median = statistics.median(samples['current'])
+    print('import {}'.format(arguments.module))
+    for name, values in samples.items():
+        print(summary(name, values))
+    if arguments.baseline:
+        baseline = statistics.median(samples['baseline'])
+        print('median change: {:+.1f}ms ({:+.1%})'.format(median - baseline, (median - baseline) / baseline))
+    if arguments.max_ms is not None and median > arguments.max_ms:
+        print('median import time exceeds {:.1f}ms'.format(arguments.max_ms), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
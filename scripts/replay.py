@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+按照会话记录重放流量
+
+会话记录由设置 ``WEBAPP_TRANSCRIPT_DIR`` 后的 Web 服务生成。在项目目录运行::
+
+    python scripts/replay.py --url http://127.0.0.1:8090 --speed 2 --concurrency 4 transcripts/*.jsonl
+
+每个被记录的会话按原来的请求间隔（除以 ``--speed``）依次发送请求，最多 ``--concurrency`` 个会话同时进行。
+
+- chat 会话：如果指定了 ``--chat-uid``，请求发往这个已存在的后端；否则为每个会话新建一个后端，结束后删除。
+  注意：此时 chat 模型的 ``max_backends`` 要不小于 ``--concurrency``，否则多出的会话无法新建后端，记为 ``chat.create`` 的错误。
+- qa 会话：如果指定了 ``--qa-uid``，请求发往这个已存在的后端；否则新建一个所有 qa 会话共用的后端。
+
+结束时输出每类请求的数量、错误数和延迟分位数；新建后端失败的会话不发送请求，记为 ``<类别>.create`` 的错误。
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def load_sessions(files):
+    sessions = defaultdict(list)
+    for file_name in files:
+        with open(file_name, encoding='utf-8') as fp:
+            for line in fp:
+                line = line.strip()
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event.get('ev') == 'request':
+                    sessions[(event['kind'], event['sid'])].append(event)
+    for events in sessions.values():
+        events.sort(key=lambda x: x['ts'])
+    return sorted(sessions.items(), key=lambda x: x[1][0]['ts'])
+
+
+class Client:
+    def __init__(self, url, timeout):
+        self._url = url.rstrip('/')
+        self._timeout = timeout
+
+    def request(self, method, path, body=None):
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        req = urllib.request.Request(
+            self._url + path, data=data, method=method,
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(req, timeout=self._timeout) as res:
+            content = res.read()
+        return json.loads(content) if content else None
+
+    def create_backend(self, kind, wait):
+        backend = self.request('POST', '/{}/'.format(kind))
+        deadline = time.time() + wait
+        while backend['state'] != 'started':
+            if time.time() > deadline:
+                raise RuntimeError('{} backend {} not started in {}s'.format(kind, backend['uid'], wait))
+            time.sleep(1)
+            backend = self.request('GET', '/{}/{}'.format(kind, backend['uid']))
+        return backend['uid']
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(list)
+        self._errors = defaultdict(int)
+
+    def add(self, kind, latency, error=None):
+        with self._lock:
+            if error is None:
+                self._latencies[kind].append(latency)
+            else:
+                self._errors[kind] += 1
+
+    def report(self):
+        for kind in sorted(set(self._latencies) | set(self._errors)):
+            values = sorted(self._latencies[kind])
+            line = '{:<11} ok={:<6} errors={:<6}'.format(kind, len(values), self._errors[kind])
+            if len(values) > 1:
+                quantiles = statistics.quantiles(values, n=100, method='inclusive')
+                line += ' p50={:.3f}s p90={:.3f}s p99={:.3f}s max={:.3f}s'.format(
+                    quantiles[49], quantiles[89], quantiles[98], values[-1])
+            print(line)
+
+
+def replay_session(client, stats, kind, events, uid, speed):
+    owned = uid is None
+    if owned:
+        ts = time.time()
+        try:
+            uid = client.create_backend(kind, 300)
+        except (urllib.error.URLError, OSError, RuntimeError) as err:
+            # 例如后端数达到上限 (403)、内存不足 (503)：这个会话失败，不影响其它会话
+            print('{} {}: create backend: {}'.format(kind, events[0]['sid'], err), file=sys.stderr)
+            stats.add('{}.create'.format(kind), time.time() - ts, err)
+            return
+    try:
+        begin = time.time()
+        for event in events:
+            delay = (event['ts'] - events[0]['ts']) / speed - (time.time() - begin)
+            if delay > 0:
+                time.sleep(delay)
+            if kind == 'chat':
+                path = '/chat/{}?timeout={}&stateless={}'.format(
+                    uid, event.get('timeout', 15), str(event.get('stateless', False)).lower())
+                body = event['msg']
+            else:
+                path = '/qa/{}?timeout={}'.format(uid, event.get('timeout', 15))
+                body = event['question']
+            ts = time.time()
+            try:
+                client.request('POST', path, body)
+            except (urllib.error.URLError, OSError) as err:
+                print('{} {}: {}'.format(kind, event['sid'], err), file=sys.stderr)
+                stats.add(kind, time.time() - ts, err)
+            else:
+                stats.add(kind, time.time() - ts)
+    finally:
+        if owned:
+            client.request('DELETE', '/{}/{}'.format(kind, uid))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按照会话记录重放流量')
+    parser.add_argument('files', nargs='+', help='会话记录文件 (*.jsonl)')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Web 服务的地址 (default: %(default)s)')
+    parser.add_argument('--speed', type=float, default=1, help='重放速度的倍数 (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=1, help='同时进行的会话数 (default: %(default)s)')
+    parser.add_argument('--chat-uid', help='使用这个已存在的 chat 后端')
+    parser.add_argument('--qa-uid', help='使用这个已存在的 qa 后端')
+    parser.add_argument('--timeout', type=float, default=60, help='HTTP 请求超时（秒） (default: %(default)s)')
+    arguments = parser.parse_args()
+
+    sessions = load_sessions(arguments.files)
+    print('{} sessions, {} requests'.format(len(sessions), sum(len(v) for _, v in sessions)))
+    client = Client(arguments.url, arguments.timeout)
+    stats = Stats()
+    qa_uid = arguments.qa_uid
+    owned_qa = qa_uid is None and any(kind == 'qa' for (kind, _), _ in sessions)
+    if owned_qa:
+        qa_uid = client.create_backend('qa', 300)
+    begin = time.time()
+    try:
+        with ThreadPoolExecutor(arguments.concurrency) as executor:
+            futures = [
+                executor.submit(
+                    replay_session, client, stats, kind, events,
+                    arguments.chat_uid if kind == 'chat' else qa_uid, arguments.speed
+                )
+                for (kind, _), events in sessions
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        if owned_qa:
+            client.request('DELETE', '/qa/{}'.format(qa_uid))
+    print('elapsed {:.1f}s'.format(time.time() - begin))
+    stats.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,7 @@ setup(
     long_description_content_type='text/markdown',
     license='commercial',
     url='https://github.com/tanbro/lm-webdemo-site',
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     setup_requires=[
         'setuptools_scm',
         'setuptools_scm_git_archive',
@@ -31,13 +31,12 @@ setup(
         'write_to': 'lmdemo/version.py',
     },
     install_requires=[
-        'dataclasses;python_version<"3.7"',
-        'fastapi',
+        'fastapi>=0.93',
         'python-dateutil',
         'PyYAML',
         'transitions[diagrams]',
     ],
     extras_require={
-        'uvicorn': ['uvicorn', 'python-dotenv']
+        'uvicorn': ['uvicorn', 'python-dotenv', 'websockets']
     },
 )